@@ -1,69 +1,142 @@
 import os
+import argparse
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import parselmouth
 import numpy as np
 import soundfile as sf
+from atomic_file import atomic_path
+from vap_instrument import add_audio_seconds, add_instrumentation_arguments, enable_instrumentation, stage, track_file
 
-def flatten_pitch(input_path, output_path, flatten_method="mean"):
+def flattened_contour(pitch_values, flatten_method="mean"):
     """
-    Process a stereo audio file and flatten its pitch while preserving the stereo channels.
+    Target pitch of every analysis frame.
     
     Parameters:
-        input_path (str): Path to the input audio file.
-        output_path (str): Path to save the processed audio file.
+        pitch_values (ndarray): Pitch of each frame in Hz (0 for unvoiced frames).
         flatten_method (str): Method to flatten pitch ('mean' or 'linear').
     """
-    # Load the audio file
-    audio, sr = sf.read(input_path)
-    processed_channels = []
+    if flatten_method == "mean":
+        mean_pitch = np.nanmean(pitch_values[pitch_values > 0])
+        return np.full_like(pitch_values, mean_pitch)
+    # Linear interpolation
+    return np.interp(
+        np.arange(len(pitch_values)),
+        np.where(pitch_values > 0)[0],
+        pitch_values[pitch_values > 0]
+    )
+
+def target_points(flattened_pitch, duration, time_step=0.01):
+    """
+    Times and values of the target pitch tier: one point every time_step seconds, taken from the frame of the
+    same index, where that frame has a positive target pitch.
+    """
+    times = np.arange(0, duration, time_step)
+    # Same arithmetic as int(t / time_step) for each t
+    idx = (times / time_step).astype(int)
+    keep = idx < len(flattened_pitch)
+    keep[keep] = flattened_pitch[idx[keep]] > 0
+    return times[keep], flattened_pitch[idx[keep]]
+
+def build_pitch_tier(times, values, xmin, xmax):
+    """
+    PitchTier with all its points at once, instead of one "Add point" call per point.
+    
+    The tier is written in Praat's short text format and read back; repr() keeps every time and value exact.
+    
+    Parameters:
+        times (ndarray): Increasing times of the points in seconds.
+        values (ndarray): Pitch of the points in Hz.
+        xmin (float): Start time of the tier.
+        xmax (float): End time of the tier.
+    """
+    lines = ['"ooTextFile"', '"PitchTier"', repr(float(xmin)), repr(float(xmax)), str(len(times))]
+    lines += [f"{t!r}\n{v!r}" for t, v in zip(times.tolist(), values.tolist())]
+    fd, tier_path = tempfile.mkstemp(suffix=".PitchTier")
+    try:
+        with os.fdopen(fd, "w", encoding="ascii") as f:
+            f.write("\n".join(lines) + "\n")
+        return parselmouth.read(tier_path)
+    finally:
+        os.remove(tier_path)
+
+def flatten_channel(samples, sr, flatten_method="mean"):
+    """
+    Flatten the pitch of one channel.
     
-    # Process each channel separately
-    for channel_idx in range(audio.shape[1]):
-        sound = parselmouth.Sound(audio[:, channel_idx], sampling_frequency=sr)
+    Parameters:
+        samples (ndarray): Samples of the channel.
+        sr (int): Sampling rate.
+        flatten_method (str): Method to flatten pitch ('mean' or 'linear').
+    
+    Returns:
+        ndarray: Resynthesized samples.
+    """
+    sound = parselmouth.Sound(samples, sampling_frequency=sr)
+    with stage("pitch"):
         pitch = sound.to_pitch()
         pitch_values = pitch.selected_array['frequency']
-        
-        # Choose pitch flattening method
-        if flatten_method == "mean":
-            mean_pitch = np.nanmean(pitch_values[pitch_values > 0])  
-            flattened_pitch = np.full_like(pitch_values, mean_pitch)  
-        else:  # Linear interpolation
-            flattened_pitch = np.interp(
-                np.arange(len(pitch_values)),
-                np.where(pitch_values > 0)[0],
-                pitch_values[pitch_values > 0]
-            )
-        
+        flattened_pitch = flattened_contour(pitch_values, flatten_method)
+    
+    times, values = target_points(flattened_pitch, sound.duration)
+    if flatten_method == "mean" and len(times) > 0:
+        # The contour is constant, one point gives the same tier
+        times, values = times[:1], values[:1]
+    
+    with stage("manipulation"):
         manipulation = parselmouth.praat.call(sound, "To Manipulation", 0.01, 75, 600)
-        pitch_tier = parselmouth.praat.call(manipulation, "Extract pitch tier")
-        parselmouth.praat.call(pitch_tier, "Remove points between", 0, sound.duration)
-        
-        time_step = 0.01
-        times = np.arange(0, sound.duration, time_step)
-        for t in times:
-            idx = int(t / time_step)
-            if idx < len(flattened_pitch) and flattened_pitch[idx] > 0:
-                parselmouth.praat.call(pitch_tier, "Add point", t, flattened_pitch[idx])
-        
+        pitch_tier = build_pitch_tier(times, values, sound.xmin, sound.xmax)
         parselmouth.praat.call([pitch_tier, manipulation], "Replace pitch tier")
+    with stage("resynthesis"):
         resynthesized = parselmouth.praat.call(manipulation, "Get resynthesis (overlap-add)")
-        processed_channels.append(resynthesized.values[0])
-    
-    # Combine processed stereo channels
-    stereo_audio = np.column_stack(processed_channels)
-    sf.write(output_path, stereo_audio, sr, subtype='PCM_16')
+    return resynthesized.values[0]
+
+def write_atomic(output_path, audio, sr):
+    # Write next to the output then rename, so an interrupted job never leaves a partial file that would be skipped
+    with atomic_path(output_path, suffix=".wav.tmp") as tmp_path:
+        sf.write(tmp_path, audio, sr, subtype='PCM_16', format='WAV')
 
-def process_directory(input_dir, output_dir, flatten_method="mean"):
+def flatten_pitch(input_path, output_path, flatten_method="mean"):
     """
-    Process all .wav files in a directory by flattening their pitch and saving them to an output directory.
+    Process a stereo audio file and flatten its pitch while preserving the stereo channels.
     
     Parameters:
-        input_dir (str): Path to the input directory containing .wav files.
-        output_dir (str): Path to the output directory where processed files will be saved.
+        input_path (str): Path to the input audio file.
+        output_path (str): Path to save the processed audio file.
         flatten_method (str): Method to flatten pitch ('mean' or 'linear').
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
+    with track_file(input_path):
+        # Load the audio file
+        with stage("read"):
+            audio, sr = sf.read(input_path)
+        add_audio_seconds(len(audio) / sr)
+        
+        # Process each channel separately
+        processed_channels = [flatten_channel(audio[:, channel_idx], sr, flatten_method) for channel_idx in range(audio.shape[1])]
+        
+        # Combine processed stereo channels
+        stereo_audio = np.column_stack(processed_channels)
+        with stage("write"):
+            write_atomic(output_path, stereo_audio, sr)
+
+# Rough peak memory of a channel task per audio frame: the float64 file read by the task plus about five
+# float64 copies of the channel (Sound, Manipulation sound, resynthesis, result)
+TASK_BYTES_PER_FRAME = 40
+
+def _flatten_channel_task(input_path, channel_idx, flatten_method):
+    # Measured as one record per channel, the audio duration is the one of the channel
+    with track_file(input_path, channel=channel_idx):
+        with stage("read"):
+            audio, sr = sf.read(input_path)
+            samples = np.ascontiguousarray(audio[:, channel_idx])
+            del audio
+        add_audio_seconds(len(samples) / sr)
+        return flatten_channel(samples, sr, flatten_method)
+
+def _pending_files(input_dir, output_dir):
+    # (filename, input_path, output_path) of the .wav files without output yet
+    pending = []
     for filename in os.listdir(input_dir):
         if filename.endswith(".wav"):
             input_path = os.path.join(input_dir, filename)
@@ -73,14 +146,147 @@ def process_directory(input_dir, output_dir, flatten_method="mean"):
             if os.path.exists(output_path):
                 print(f"⚠️ File already exists, skipping: {filename}")
                 continue  # Skip to the next file
+            pending.append((filename, input_path, output_path))
+    return pending
 
+def process_directory(input_dir, output_dir, flatten_method="mean", workers=1, max_memory_mb=None):
+    """
+    Process all .wav files in a directory by flattening their pitch and saving them to an output directory.
+    
+    With several workers, every channel of every file is a task of a process pool. The longest files are
+    scheduled first (no long file left alone at the end), the channels of a file are put back together when
+    they are all done and the file is written atomically. A file that cannot be read or whose task fails is
+    reported and the others go on. When a worker process dies (e.g. killed by the OOM killer), the tasks it
+    may have been running are retried alone on a new pool, and a task that kills its worker alone fails its file.
+    
+    Parameters:
+        input_dir (str): Path to the input directory containing .wav files.
+        output_dir (str): Path to the output directory where processed files will be saved.
+        flatten_method (str): Method to flatten pitch ('mean' or 'linear').
+        workers (int): Number of worker processes (1 processes the files one after another).
+        max_memory_mb (float): When set, tasks are only started while the estimated memory of the running
+            tasks (see TASK_BYTES_PER_FRAME) stays below this limit; a task is always started when none runs.
+    
+    Returns:
+        list: (filename, error) of the files that failed.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    pending = _pending_files(input_dir, output_dir)
+    failed = []
+    if workers <= 1:
+        for filename, input_path, output_path in pending:
             print(f" Processing {filename}...")
-            flatten_pitch(input_path, output_path, flatten_method)
+            try:
+                flatten_pitch(input_path, output_path, flatten_method)
+            except Exception as e:
+                print(f" ERROR: {filename} - {type(e).__name__}: {e}")
+                failed.append((filename, f"{type(e).__name__}: {e}"))
+                continue
             print(f"✅ Saved: {output_path}")
+        return failed
+    
+    infos = {}
+    for filename, input_path, _ in pending:
+        try:
+            infos[input_path] = sf.info(input_path)
+        except Exception as e:
+            print(f" ERROR: {filename} - {type(e).__name__}: {e}")
+            failed.append((filename, f"{type(e).__name__}: {e}"))
+    pending = [item for item in pending if item[1] in infos]
+    
+    # Longest files first, each file gives one task per channel
+    pending.sort(key=lambda item: infos[item[1]].frames, reverse=True)
+    tasks = [(input_path, channel_idx) for _, input_path, _ in pending for channel_idx in range(infos[input_path].channels)]
+    task_bytes = {input_path: info.frames * (8 * info.channels + TASK_BYTES_PER_FRAME) for input_path, info in infos.items()}
+    max_bytes = None if max_memory_mb is None else max_memory_mb * 1024 * 1024
+    output_paths = {input_path: (filename, output_path) for filename, input_path, output_path in pending}
+    
+    results = {input_path: [None] * info.channels for input_path, info in infos.items()}
+    suspects = set()  # Tasks that were running when a worker died, each one is retried alone
+    running = {}  # future -> task
+    running_bytes = 0
+    
+    def fail(input_path, error):
+        # Report a file once, its other channels are not processed or written
+        if input_path in results:
+            filename = output_paths[input_path][0]
+            print(f" ERROR: {filename} - {error}")
+            failed.append((filename, error))
+            results.pop(input_path)
+    
+    executor = ProcessPoolExecutor(workers)
+    try:
+        while tasks or running:
+            # Start tasks while a worker is free and the memory limit allows it, a suspect task only when none runs
+            while tasks and len(running) < workers and not suspects & set(running.values()):
+                input_path, channel_idx = tasks[0]
+                if input_path not in results:
+                    tasks.pop(0)  # Another channel of the file failed
+                    continue
+                if running and (tasks[0] in suspects or (max_bytes is not None and running_bytes + task_bytes[input_path] > max_bytes)):
+                    break
+                tasks.pop(0)
+                if channel_idx == 0:
+                    print(f" Processing {output_paths[input_path][0]}...")
+                running[executor.submit(_flatten_channel_task, input_path, channel_idx, flatten_method)] = (input_path, channel_idx)
+                running_bytes += task_bytes[input_path]
+            if not running:
+                continue
+            
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in finished):
+                # A worker died: the tasks still running fail with the pool
+                finished, _ = wait(running)
+            broken = []
+            for future in finished:
+                input_path, channel_idx = running.pop(future)
+                running_bytes -= task_bytes[input_path]
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    broken.append((input_path, channel_idx))
+                    continue
+                if error is not None:
+                    fail(input_path, f"{type(error).__name__}: {error}")
+                    continue
+                if input_path not in results:
+                    continue  # The other channel failed, the file is not written
+                results[input_path][channel_idx] = future.result()
+                if all(channel is not None for channel in results[input_path]):
+                    # Combine processed stereo channels
+                    output_path = output_paths[input_path][1]
+                    with stage("write"):
+                        write_atomic(output_path, np.column_stack(results.pop(input_path)), infos[input_path].samplerate)
+                    print(f"✅ Saved: {output_path}")
+            
+            if broken:
+                executor.shutdown(wait=True)
+                executor = ProcessPoolExecutor(workers)
+                if len(broken) == 1:
+                    # It was running alone, so it is the one that killed its worker
+                    fail(broken[0][0], "BrokenProcessPool: the worker process died (killed or out of memory)")
+                else:
+                    suspects.update(broken)
+                    tasks[:0] = sorted(broken)
+    finally:
+        executor.shutdown(wait=True)
+    return failed
 
 if __name__ == "__main__":
-    input_directory = ""  # Directory containing input audio files
-    output_directory = ""  # Directory to save processed files
+    parser = argparse.ArgumentParser(description="Flatten the pitch of every .wav file of a directory")
+    parser.add_argument("input_directory", type=str, help="Directory containing input audio files")
+    parser.add_argument("output_directory", type=str, help="Directory to save processed files")
+    parser.add_argument("--flatten_method", type=str, default="mean", choices=["mean", "linear"], help="Pitch flattening method")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, each one flattening one channel at a time")
+    parser.add_argument("--max_memory_mb", type=float, default=None, help="Estimated memory limit of the running tasks")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    enable_instrumentation(args.instrument, args.profile_dir)
     
-    process_directory(input_directory, output_directory, flatten_method="mean")
+    failed = process_directory(args.input_directory, args.output_directory, flatten_method=args.flatten_method,
+                               workers=args.workers, max_memory_mb=args.max_memory_mb)
+    if failed:
+        print(f" {len(failed)} files failed: {', '.join(filename for filename, _ in failed)}")
+        raise SystemExit(1)
     print("✅ All .wav files have been processed!")
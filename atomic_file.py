@@ -0,0 +1,35 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+def _target_mode(path):
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        # The umask can only be read by setting it
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+@contextmanager
+def atomic_path(path, suffix=".tmp"):
+    """
+    Temporary path in the directory of path, renamed to path when the block succeeds and removed when it fails,
+    so readers never see a partial file and an interrupted job never leaves one that a re-run would skip.
+    The file gets the mode of the file it replaces, or the one open() would give it (mkstemp creates it 0600).
+
+    Parameters:
+        path (str): Final path of the file.
+        suffix (str): Suffix of the temporary file (writers choosing the format from the extension need one).
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=suffix)
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.chmod(tmp_path, _target_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
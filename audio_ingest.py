@@ -0,0 +1,223 @@
+import os
+import wave
+import shutil
+import struct
+import subprocess
+import numpy as np
+from atomic_file import atomic_path
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format, bits per sample) of the .wav files that can be memory-mapped as they are
+_WAV_DTYPES = {
+    (WAVE_FORMAT_PCM, 16): "<i2",
+    (WAVE_FORMAT_PCM, 32): "<i4",
+    (WAVE_FORMAT_IEEE_FLOAT, 32): "<f4",
+}
+
+
+def _wav_layout(wav_path):
+    # Return (format, channels, frame rate, bits per sample, data offset, data size) from the RIFF header of a .wav file
+    file_size = os.path.getsize(wav_path)
+    with open(wav_path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"{wav_path} is not a RIFF/WAVE file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in {wav_path}")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                chunk = f.read(chunk_size)
+                audio_format, n_channels, frame_rate, _, _, bits = struct.unpack("<HHIIHH", chunk[:16])
+                if audio_format == WAVE_FORMAT_EXTENSIBLE and len(chunk) >= 26:
+                    audio_format = struct.unpack("<H", chunk[24:26])[0]  # First bytes of the sub-format GUID
+                fmt = (audio_format, n_channels, frame_rate, bits)
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"Data chunk before fmt chunk in {wav_path}")
+                offset = f.tell()
+                # Streamed .wav files may leave the size at 0 or 0xFFFFFFFF
+                data_size = min(chunk_size, file_size - offset) if chunk_size else file_size - offset
+                return fmt + (offset, data_size)
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _sphere_header(sph_path):
+    # Return (fields, header size) of the NIST SPHERE header of a .sph file
+    with open(sph_path, "rb") as f:
+        if f.readline().strip() != b"NIST_1A":
+            raise ValueError(f"{sph_path} is not a NIST SPHERE file")
+        header_size = int(f.readline())
+        f.seek(0)
+        lines = f.read(header_size).decode("ascii", errors="replace").splitlines()
+    fields = {}
+    for line in lines[2:]:
+        if line.strip() == "end_head":
+            break
+        parts = line.split(None, 2)
+        if len(parts) == 3:
+            name, kind, value = parts
+            fields[name] = int(value) if kind == "-i" else float(value) if kind == "-r" else value
+    return fields, header_size
+
+
+def _ulaw_table():
+    # G.711 mu-law byte -> 16-bit sample
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    magnitude = (((codes & 0x0F) << 3) + 0x84) << ((codes >> 4) & 0x07)
+    return np.where(codes & 0x80, 0x84 - magnitude, magnitude - 0x84).astype(np.int16)
+
+
+_ULAW_TABLE = _ulaw_table()
+
+
+def decode_sphere(sph_path):
+    """
+    Native decoding of an uncompressed NIST SPHERE file (16-bit pcm or mu-law, as Switchboard).
+
+    Returns:
+        tuple: (int16 samples as a (n_frames, n_channels) array, frame rate).
+    """
+    fields, header_size = _sphere_header(sph_path)
+    coding = fields.get("sample_coding", "pcm")
+    n_channels = fields.get("channel_count", 1)
+    if coding in ("ulaw", "mu-law"):
+        samples = _ULAW_TABLE[np.fromfile(sph_path, dtype=np.uint8, offset=header_size)]
+    elif coding == "pcm" and fields.get("sample_n_bytes", 2) == 2:
+        dtype = ">i2" if fields.get("sample_byte_format", "01") == "10" else "<i2"
+        samples = np.fromfile(sph_path, dtype=dtype, offset=header_size).astype(np.int16)
+    else:
+        raise ValueError(f"{sph_path}: SPHERE sample coding {coding!r} can only be decoded by sox")
+    n_frames = len(samples) // n_channels
+    return samples[:n_frames * n_channels].reshape(n_frames, n_channels), fields["sample_rate"]
+
+
+def sox_decode(audio_file, n_channels, sampling_rate=16000):
+    # Same conversion as convert_sph_to_wav.sh (sox -r 16000 -b 16 -e signed-integer), piped to memory instead of a .wav file
+    command = ["sox", audio_file, "-t", "raw", "-r", str(sampling_rate), "-b", "16", "-e", "signed-integer", "-L", "-"]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"sox failed on {audio_file}: {result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype="<i2").reshape(-1, n_channels), sampling_rate
+
+
+def load_sphere(sph_path, sampling_rate=16000):
+    """
+    Decode a .sph file to int16 samples at sampling_rate, in memory.
+
+    sox is used when installed (the samples are then the ones of the .wav files of convert_sph_to_wav.sh),
+    otherwise uncompressed files are decoded natively and resampled with torchaudio.
+
+    Returns:
+        tuple: ((n_frames, n_channels) int16 array, sampling_rate).
+    """
+    if shutil.which("sox"):
+        return sox_decode(sph_path, _sphere_header(sph_path)[0].get("channel_count", 1), sampling_rate)
+    samples, frame_rate = decode_sphere(sph_path)
+    if frame_rate != sampling_rate:
+        import torch
+        import torchaudio
+        audio = torchaudio.functional.resample(torch.from_numpy(samples.T.astype(np.float32)), frame_rate, sampling_rate)
+        samples = np.clip(np.round(audio.numpy().T), -32768, 32767).astype(np.int16)
+    return samples, sampling_rate
+
+
+def write_wav(wav_path, samples, frame_rate):
+    # Write int16 samples as a .wav file, atomically (temporary file renamed) so a partial file is never left
+    with atomic_path(wav_path, suffix=".wav.tmp") as tmp_path, wave.open(tmp_path, "wb") as wav:
+        wav.setnchannels(samples.shape[1])
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        wav.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+
+
+def load_pcm(audio_file):
+    """
+    Read the interleaved samples of an audio file once, without decoding them to another format.
+
+    16/32-bit PCM and 32-bit float .wav files are memory-mapped (no copy at all), .sph files are decoded to
+    16kHz int16 in memory (load_sphere); any other file is decoded once with pydub.
+
+    Returns:
+        tuple: (samples as a (n_frames, n_channels) array, frame rate).
+    """
+    if audio_file.lower().endswith(".sph"):
+        return load_sphere(audio_file)
+    if audio_file.lower().endswith(".wav"):
+        try:
+            audio_format, n_channels, frame_rate, bits, offset, data_size = _wav_layout(audio_file)
+        except (ValueError, struct.error):
+            pass
+        else:
+            dtype = _WAV_DTYPES.get((audio_format, bits))
+            if dtype is not None:
+                n_frames = data_size // (n_channels * np.dtype(dtype).itemsize)
+                if n_frames == 0:
+                    return np.zeros((0, n_channels), dtype=dtype), frame_rate
+                samples = np.memmap(audio_file, dtype=dtype, mode="r", offset=offset, shape=(n_frames, n_channels))
+                return samples, frame_rate
+
+    from pydub import AudioSegment
+    sound = AudioSegment.from_file(audio_file)
+    # pydub keeps signed samples of 1, 2 or 4 bytes (24-bit audio is converted to 32-bit when loaded)
+    samples = np.frombuffer(sound.raw_data, dtype=f"<i{sound.sample_width}")
+    return samples.reshape(-1, sound.channels), sound.frame_rate
+
+
+def iter_pcm_blocks(audio_file, block_frames):
+    """
+    Read the interleaved samples of a .wav file block by block, so the memory does not depend on its length.
+
+    Returns:
+        tuple: (frame rate, number of channels, generator of (n_frames, n_channels) arrays).
+    """
+    audio_format, n_channels, frame_rate, bits, offset, data_size = _wav_layout(audio_file)
+    dtype = _WAV_DTYPES.get((audio_format, bits))
+    if dtype is None:
+        raise ValueError(f"Block reading needs 16/32-bit PCM or 32-bit float .wav files, got format {audio_format} ({bits} bits)")
+    frame_size = n_channels * np.dtype(dtype).itemsize
+
+    def blocks():
+        with open(audio_file, "rb") as f:
+            f.seek(offset)
+            remaining = data_size - data_size % frame_size
+            while remaining > 0:
+                data = f.read(min(remaining, block_frames * frame_size))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield np.frombuffer(data, dtype=dtype).reshape(-1, n_channels)
+
+    return frame_rate, n_channels, blocks()
+
+
+def to_float32(samples):
+    # Scale integer PCM to [-1, 1] the way read_audio does (int16 / 32768)
+    audio = np.array(samples, dtype=np.float32)
+    if samples.dtype.kind != "f":
+        audio /= float(2 ** (8 * samples.dtype.itemsize - 1))
+    return audio
+
+
+def channel_tensor(samples, channel, frame_rate, sampling_rate=16000):
+    """
+    Float32 torch tensor of one channel at the sampling rate of the VAD model.
+
+    Only the strided view of the channel is converted (one copy), and resampling is done only when the
+    source rate is not already sampling_rate.
+    """
+    import torch
+
+    audio = torch.from_numpy(to_float32(samples[:, channel]))
+    if frame_rate != sampling_rate:
+        import torchaudio
+        audio = torchaudio.functional.resample(audio, frame_rate, sampling_rate)
+    return audio
+
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import argparse
+import numpy as np
+from multiprocessing import Pool
+
+# Time bullet of an utterance: NAK start_end NAK, in milliseconds
+BULLET = re.compile(r'\x15(\d+)_(\d+)\x15')
+
+UTTERANCE_DTYPE = np.dtype([("file_id", np.int32), ("speaker_id", np.int32), ("start_ms", np.int64), ("end_ms", np.int64)])
+GROUP_DTYPE = np.dtype([("file_id", np.int32), ("speaker_id", np.int32), ("start", np.int64), ("stop", np.int64)])
+
+
+def iter_utterances(filepath):
+    """
+    Read a .cha file line by line and yield (speaker, start_ms, end_ms) of every timed utterance, in file order.
+
+    A tier continues on the following lines starting with a tab, so the bullet of a main tier (*SPK:) is found
+    even when the utterance spans several lines. Headers (@) and dependent tiers (%mor, %com, ...) are skipped,
+    with any bullet they contain. The first bullet of a main tier gives its timing.
+    """
+    tier = None
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('\t') and tier is not None:
+                tier.append(line)
+                continue
+            if tier is not None:
+                yield from _main_tier_timing(tier)
+            tier = [line] if line.startswith('*') else None
+    if tier is not None:
+        yield from _main_tier_timing(tier)
+
+
+def _main_tier_timing(tier):
+    # (speaker, start, end) of a main tier given as its lines, nothing if it has no bullet
+    text = "".join(tier)
+    speaker, _, content = text[1:].partition(':')
+    bullet = BULLET.search(content)
+    if bullet is not None:
+        yield speaker, int(bullet.group(1)), int(bullet.group(2))
+
+
+def _index_file(filepath):
+    # Worker task of build_index: (speakers in order of appearance, (n, 3) speaker position/start/end array) or an error
+    try:
+        speakers = {}
+        rows = []
+        for speaker, start_ms, end_ms in iter_utterances(filepath):
+            rows.append((speakers.setdefault(speaker, len(speakers)), start_ms, end_ms))
+        return list(speakers), np.array(rows, dtype=np.int64).reshape(-1, 3), None
+    except Exception as e:
+        return None, None, f"{type(e).__name__}: {e}"
+
+
+def find_chat_files(chat_dir):
+    # Every .cha file below chat_dir (CHILDES corpora are nested by child and age), sorted
+    chat_files = []
+    for root, _, filenames in os.walk(chat_dir):
+        chat_files += [os.path.join(root, filename) for filename in filenames if filename.endswith(".cha")]
+    return sorted(chat_files)
+
+
+def build_index(chat_dir, index_dir, workers=None):
+    """
+    Parse every .cha file of a CHILDES directory once, on a process pool, and store all the timed utterances
+    as NumPy arrays in index_dir:
+
+        utterances.npy  (n,) structured array: file_id, speaker_id, start_ms, end_ms, grouped by file then
+                        speaker (speakers in order of first appearance in the file), in file order in a group
+        groups.npy      one row per (file, speaker): utterances[start:stop] are the ones of that speaker
+        meta.json       root directory, file paths (relative to it) and speaker codes
+
+    Parameters:
+        chat_dir (str): Root of the corpus.
+        index_dir (str): Output directory (created if needed).
+        workers (int): Number of worker processes (default: number of CPUs).
+
+    Returns:
+        list: (file, error) of the files that could not be parsed.
+    """
+    chat_files = find_chat_files(chat_dir)
+    files = []
+    speaker_ids = {}
+    utterances = []
+    groups = []
+    failed = []
+    n_utterances = 0
+    with Pool(workers) as pool:
+        for chat_file, (speakers, rows, error) in zip(chat_files, pool.imap(_index_file, chat_files, chunksize=16)):
+            if error is not None:
+                print(f" ERROR: {chat_file} - {error}")
+                failed.append((chat_file, error))
+                continue
+            file_id = len(files)
+            files.append(os.path.relpath(chat_file, chat_dir))
+            for position, speaker in enumerate(speakers):
+                speaker_rows = rows[rows[:, 0] == position]
+                table = np.zeros(len(speaker_rows), dtype=UTTERANCE_DTYPE)
+                table["file_id"] = file_id
+                table["speaker_id"] = speaker_ids.setdefault(speaker, len(speaker_ids))
+                table["start_ms"] = speaker_rows[:, 1]
+                table["end_ms"] = speaker_rows[:, 2]
+                utterances.append(table)
+                groups.append((file_id, table["speaker_id"][0], n_utterances, n_utterances + len(table)))
+                n_utterances += len(table)
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "utterances.npy"), np.concatenate(utterances) if utterances else np.zeros(0, dtype=UTTERANCE_DTYPE))
+    np.save(os.path.join(index_dir, "groups.npy"), np.array(groups, dtype=GROUP_DTYPE))
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"root": os.path.abspath(chat_dir), "files": files, "speakers": list(speaker_ids)}, f)
+    print(f" {n_utterances} utterances of {len(files)}/{len(chat_files)} files indexed in {index_dir}")
+    return failed
+
+
+class ChatIndex:
+    """
+    Index written by build_index. The arrays are memory-mapped but meta.json is parsed on opening, so one
+    instance should serve all the lookups of a process.
+
+    Parameters:
+        index_dir (str): Directory written by build_index.
+    """
+
+    def __init__(self, index_dir, mmap=True):
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.root = meta["root"]
+        self.files = meta["files"]
+        self.speakers = meta["speakers"]
+        self.utterances = np.load(os.path.join(index_dir, "utterances.npy"), mmap_mode=mmap_mode)
+        self.groups = np.load(os.path.join(index_dir, "groups.npy"), mmap_mode=mmap_mode)
+        self._file_ids = {path: file_id for file_id, path in enumerate(self.files)}
+        # Groups of a file are consecutive
+        self._group_starts = np.searchsorted(self.groups["file_id"], np.arange(len(self.files) + 1))
+
+    def file_id(self, chat_file):
+        # Id of a .cha file given relative to the corpus root or as any path to it
+        if chat_file in self._file_ids:
+            return self._file_ids[chat_file]
+        return self._file_ids[os.path.relpath(os.path.abspath(chat_file), self.root)]
+
+    def file_utterances(self, chat_file):
+        # Rows of utterances.npy of one file, grouped by speaker
+        file_id = self.file_id(chat_file)
+        groups = self.groups[self._group_starts[file_id]:self._group_starts[file_id + 1]]
+        if len(groups) == 0:
+            return self.utterances[:0]
+        return self.utterances[groups["start"][0]:groups["stop"][-1]]
+
+    def timestamps(self, chat_file):
+        """
+        Timestamps of one file as mono_to_stereo.extract_timestamps returns them: {speaker: [(start, end), ...]}.
+        """
+        file_id = self.file_id(chat_file)
+        timestamps_dic = {}
+        for group in self.groups[self._group_starts[file_id]:self._group_starts[file_id + 1]]:
+            rows = self.utterances[group["start"]:group["stop"]]
+            timestamps_dic[self.speakers[group["speaker_id"]]] = list(zip(rows["start_ms"].tolist(), rows["end_ms"].tolist()))
+        return timestamps_dic
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the timed utterances of every .cha file of a CHILDES directory")
+    parser.add_argument("chat_dir", type=str, help="Root of the corpus")
+    parser.add_argument("index_dir", type=str, help="Output directory of the index")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    failed = build_index(args.chat_dir, args.index_dir, args.workers)
+    raise SystemExit(1 if failed else 0)
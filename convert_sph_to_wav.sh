@@ -1,39 +1,47 @@
 #!/bin/bash
 
-# Define the destination folder for the converted files
-DESTINATION="/home/youcef.brahimi/Downloads/wav_files"
+# Note: vap_batch.py --sph reads the .sph files directly (decoded in memory), this script is only needed to keep a
+# .wav copy of the corpus (vap_batch.py --sph --wav_dir does the same while building the data)
+
+# Folder containing the Switchboard directories and destination folder for the converted files
+SOURCE_ROOT="${1:-$(pwd)}"
+DESTINATION="${2:-$SOURCE_ROOT/wav_files}"
+
+# Number of parallel sox processes
+WORKERS="${WORKERS:-$(nproc)}"
 
 # Create the destination folder if it doesn't exist
 mkdir -p "$DESTINATION"
 
+# Check if the destination folder is writable
+if [ ! -w "$DESTINATION" ]; then
+    echo "❌ ERROR: No write permission on $DESTINATION"
+    exit 1
+fi
+
 # Directories containing .sph files
 SOURCE_DIRS=("swb1_d1_data" "swb1_d2_data" "swb1_d3_data" "swb1_d4_data")
 
-# Loop through each source directory
-for dir in "${SOURCE_DIRS[@]}"; do
-  echo "Searching in directory: /home/youcef.brahimi/Downloads/$dir"
-
-  # Find all .sph files and convert them to .wav with 16kHz
-  find "/home/youcef.brahimi/Downloads/$dir" -type f -name "*.sph" | while read FILE_PATH; do
+convert() {
+    FILE_PATH="$1"
     OUTPUT_FILE="$DESTINATION/$(basename "${FILE_PATH%.sph}.wav")"
 
     echo "Processing: $FILE_PATH"
 
-    # Check if the destination folder is writable
-    if [ ! -w "$DESTINATION" ]; then
-        echo "❌ ERROR: No write permission on $DESTINATION"
-        exit 1
-    fi
-
     # Convert using SoX
-    sox "$FILE_PATH" -r 16000 -b 16 -e signed-integer "$OUTPUT_FILE"
-
-    if [ $? -eq 0 ]; then
+    if sox "$FILE_PATH" -r 16000 -b 16 -e signed-integer "$OUTPUT_FILE"; then
         echo "✅ File converted: $OUTPUT_FILE"
     else
         echo "❌ ERROR: Conversion failed for $FILE_PATH"
     fi
-  done
-done
+}
+export -f convert
+export DESTINATION
+
+# Find all .sph files of every source directory and convert them to .wav with 16kHz, WORKERS files at a time
+for dir in "${SOURCE_DIRS[@]}"; do
+  echo "Searching in directory: $SOURCE_ROOT/$dir" >&2
+  find "$SOURCE_ROOT/$dir" -type f -name "*.sph"
+done | xargs -d '\n' -P "$WORKERS" -I {} bash -c 'convert "$1"' _ {}
 
 echo " Conversion completed. The .wav files are in $DESTINATION"
@@ -1,73 +1,199 @@
-import re
+import csv
 import numpy as np
 import wave
 import argparse
+from multiprocessing import Pool
+from chat_index import ChatIndex, iter_utterances
+from vap_instrument import add_audio_seconds, add_instrumentation_arguments, enable_instrumentation, stage, track_file
 
-def find_speech_overlaps(timestamps_dic):
-    # Return a list of tuple with every overlaps in a dict of timestamps
-    overlaps_list = []
+def speech_overlap_arrays(timestamps_dic):
+    """
+    Every overlap between utterances of different speakers, as NumPy arrays.
+
+    All the utterances are sorted once by start: the utterances starting during an utterance are the next
+    ones in that order, up to the first one starting after its end, so each utterance gives one contiguous
+    range of overlapping utterances (O(n log n + k), k being the number of overlapping pairs). Two
+    utterances overlap when start1 < end2 and start2 < end1, as in find_speech_overlaps.
+
+    Parameters:
+        timestamps_dic (dict): (start, end) of the utterances of each speaker, as extract_timestamps returns them.
 
-    dict_keys = list(timestamps_dic.keys())
-    for speaker1 in range(len(dict_keys)-1): # Don't compare the last speaker, useless
-        for speaker2 in range(speaker1 +1, len(dict_keys)):
-            for i in range(len(timestamps_dic[dict_keys[speaker1]])):
-                start1, end1 = timestamps_dic[dict_keys[speaker1]][i]
-                for j in range(len(timestamps_dic[dict_keys[speaker2]])):
-                    start2, end2 = timestamps_dic[dict_keys[speaker2]][j]
+    Returns:
+        dict: speakers (list of ids, in the order of timestamps_dic),
+              pairs ((k, 4) int64 array: speaker1, utterance index1, speaker2, utterance index2, with
+                     speaker1 < speaker2 indexes in speakers, sorted like find_speech_overlaps),
+              durations ((k,) overlap duration of each pair, in the unit of the timestamps),
+              totals ((n_speakers, n_speakers) symmetric sum of the overlap durations of each speaker pair).
+    """
+    speakers = list(timestamps_dic.keys())
+    utterances = [(speaker, index, start, end) for speaker, key in enumerate(speakers)
+                  for index, (start, end) in enumerate(timestamps_dic[key])]
+    speaker_ids = np.array([utterance[0] for utterance in utterances], dtype=np.int64)
+    indexes = np.array([utterance[1] for utterance in utterances], dtype=np.int64)
+    starts = np.array([utterance[2] for utterance in utterances])
+    ends = np.array([utterance[3] for utterance in utterances])
 
-                    # Check for overlap:
-                    if start1 < end2 and start2 < end1:
-                        overlaps_list.append(((dict_keys[speaker1], i), (dict_keys[speaker2], j)))
-    return overlaps_list
+    # Proper utterances (start < end): the ones starting in [start, end) after it in start order overlap it
+    proper = np.flatnonzero(starts < ends)
+    order = proper[np.argsort(starts[proper], kind="stable")]
+    sorted_starts = starts[order]
+    range_ends = np.searchsorted(sorted_starts, ends[order], side="left")
+    counts = np.maximum(range_ends - np.arange(len(order)) - 1, 0)
+    first = np.repeat(np.arange(len(order)), counts)
+    second = first + 1 + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    first, second = order[first], order[second]
+
+    # Empty or reversed utterances (start >= end, transcription errors) can only overlap proper ones
+    for degenerate in np.flatnonzero(starts >= ends):
+        candidates = order[:np.searchsorted(sorted_starts, ends[degenerate], side="left")]
+        candidates = candidates[ends[candidates] > starts[degenerate]]
+        first = np.concatenate([first, np.full(len(candidates), degenerate)])
+        second = np.concatenate([second, candidates])
+
+    # Only keep pairs of different speakers, the lowest speaker first
+    different = speaker_ids[first] != speaker_ids[second]
+    first, second = first[different], second[different]
+    swap = speaker_ids[first] > speaker_ids[second]
+    first, second = np.where(swap, second, first), np.where(swap, first, second)
+    pairs = np.stack([speaker_ids[first], indexes[first], speaker_ids[second], indexes[second]], axis=1).reshape(-1, 4)
+    sort = np.lexsort((pairs[:, 3], pairs[:, 1], pairs[:, 2], pairs[:, 0]))
+    pairs, first, second = pairs[sort], first[sort], second[sort]
+
+    durations = np.maximum(np.minimum(ends[first], ends[second]) - np.maximum(starts[first], starts[second]), 0)
+    totals = np.zeros((len(speakers), len(speakers)), dtype=durations.dtype if len(utterances) else np.int64)
+    np.add.at(totals, (pairs[:, 0], pairs[:, 2]), durations)
+    totals += totals.T
+    return {"speakers": speakers, "pairs": pairs, "durations": durations, "totals": totals}
+
+def find_speech_overlaps(timestamps_dic):
+    # Return a list of tuple with every overlaps in a dict of timestamps
+    overlaps = speech_overlap_arrays(timestamps_dic)
+    speakers = overlaps["speakers"]
+    return [((speakers[speaker1], index1), (speakers[speaker2], index2))
+            for speaker1, index1, speaker2, index2 in overlaps["pairs"].tolist()]
 
 
 def extract_timestamps(filepath):
     # Extract timestamps of speechs from a .cha file and return them as a dictionnary of tuple (start : int, end : int) with key as speaker id
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    # Use regular expression to find timestamp wrapped between NAK characters ( \x15 in hex)
-    extracted_string = re.findall(r'\*(.*?):.*?\x15(.*?)\x15', content)
-    # Add timestamps in a dictionnary
+    # The file is read line by line, multi-line main tiers and dependent tiers are handled by chat_index.iter_utterances
     timestamps_dic = {}
-    for string in extracted_string:
-            num1, num2 = map(int, string[1].split('_'))
-            if string[0] not in timestamps_dic:
-                timestamps_dic[string[0]] = [(num1, num2)]
-            else:
-                timestamps_dic[string[0]].append((num1, num2))
-            
+    for speaker, start_ms, end_ms in iter_utterances(filepath):
+        timestamps_dic.setdefault(speaker, []).append((start_ms, end_ms))
     return timestamps_dic
 
-def mono_to_stereo(wav_mono_path, timestamps_dict, output_path):
+def channel_intervals(timestamps_dict, frame_rate, n_frames):
+    """
+    Sorted channel-assignment index of the timestamps: for each channel (0 for CHI, 1 for the other speakers),
+    the disjoint [start_frame, end_frame) intervals where the mono audio is copied.
+
+    Returns:
+        list: (starts, ends) int64 arrays of channel 0 and channel 1.
+    """
+    channels = [([], []), ([], [])]
+    for speaker, timestamps in timestamps_dict.items():
+        channel = 0 if speaker == 'CHI' else 1
+        for start_ms, end_ms in timestamps:
+            channels[channel][0].append(int((start_ms / 1000) * frame_rate))
+            channels[channel][1].append(int((end_ms / 1000) * frame_rate))
+
+    intervals = []
+    for starts, ends in channels:
+        starts = np.clip(np.array(starts, dtype=np.int64), 0, n_frames)
+        ends = np.clip(np.array(ends, dtype=np.int64), 0, n_frames)
+        keep = starts < ends
+        starts, ends = starts[keep], ends[keep]
+        order = np.argsort(starts, kind="stable")
+        starts, ends = starts[order], np.maximum.accumulate(ends[order])
+        # Merge the overlapping or touching intervals: a new interval begins where the start is after every previous end
+        new = np.ones(len(starts), dtype=bool)
+        new[1:] = starts[1:] > ends[:-1]
+        group_starts = np.flatnonzero(new)
+        intervals.append((starts[group_starts], ends[np.append(group_starts[1:], len(starts)) - 1] if len(starts) else ends))
+    return intervals
+
+def _block_mask(block_start, block_length, starts, ends):
+    # True for the frames of the block inside one of the sorted disjoint [starts, ends) intervals
+    first = np.searchsorted(ends, block_start, side="right")
+    last = np.searchsorted(starts, block_start + block_length, side="left")
+    # +1 where an interval begins and -1 where it ends (merged intervals never touch), the running sum is the mask
+    edges = np.zeros(block_length + 1, dtype=np.int8)
+    edges[np.maximum(starts[first:last] - block_start, 0)] = 1
+    edges[np.minimum(ends[first:last] - block_start, block_length)] = -1
+    return np.cumsum(edges[:-1], dtype=np.int8) > 0
+
+def mono_to_stereo(wav_mono_path, timestamps_dict, output_path, block_frames=1 << 20):
     # Create a stereo .wav from a mono .wav and a timestamps dictionnary
+    # The audio is read and written block by block, so the memory does not depend on the recording length
     with wave.open(wav_mono_path, 'rb') as mono_wav:
-        n_channels = mono_wav.getnchannels()
         sample_width = mono_wav.getsampwidth()
         frame_rate = mono_wav.getframerate()
         n_frames = mono_wav.getnframes()
-        audio_data = np.frombuffer(mono_wav.readframes(n_frames), dtype=np.int16)
-        
-        stereo_data = np.zeros((n_frames, 2), dtype=np.int16)
+        add_audio_seconds(n_frames / frame_rate)
+        with stage("intervals"):
+            intervals = channel_intervals(timestamps_dict, frame_rate, n_frames)
+
+        # Reading, masking and writing are interleaved block by block, they are measured as one stage
+        with stage("convert"), wave.open(output_path, 'wb') as stereo_wav:
+            stereo_wav.setnchannels(2)
+            stereo_wav.setsampwidth(sample_width)
+            stereo_wav.setframerate(frame_rate)
+
+            for block_start in range(0, n_frames, block_frames):
+                audio_data = np.frombuffer(mono_wav.readframes(block_frames), dtype=np.int16)
+                stereo_data = np.zeros((len(audio_data), 2), dtype=np.int16)
+                for channel, (starts, ends) in enumerate(intervals):
+                    stereo_data[:, channel] = np.where(_block_mask(block_start, len(audio_data), starts, ends), audio_data, 0)
+                stereo_wav.writeframes(stereo_data.tobytes())
+
+# ChatIndex of each index directory, loaded once per process (each worker of convert_manifest reuses it for all its files)
+_chat_indexes = {}
 
-        for speaker, timestamps in timestamps_dict.items():
-            if speaker == 'CHI':
-                channel = 0
+def load_timestamps(transcript_path, index_dir=None):
+    # Timestamps of a .cha file, from the corpus index built by chat_index.py when given instead of parsing the file
+    if index_dir is None:
+        return extract_timestamps(transcript_path)
+    if index_dir not in _chat_indexes:
+        _chat_indexes[index_dir] = ChatIndex(index_dir)
+    return _chat_indexes[index_dir].timestamps(transcript_path)
+
+def _convert_pair(task):
+    # Worker task of convert_manifest: (audio path, transcript path, output path, block frames, index dir) -> (output path, error)
+    audio_path, transcript_path, output_path, block_frames, index_dir = task
+    try:
+        with track_file(audio_path):
+            with stage("timestamps"):
+                timestamps_dict = load_timestamps(transcript_path, index_dir)
+            mono_to_stereo(audio_path, timestamps_dict, output_path, block_frames)
+        return output_path, None
+    except Exception as e:
+        return output_path, f"{type(e).__name__}: {e}"
+
+def convert_manifest(manifest_path, workers=None, block_frames=1 << 20, index_dir=None):
+    """
+    Convert many .wav/.cha pairs on a process pool.
+
+    Parameters:
+        manifest_path (str): CSV file with the columns audio_path, transcript_path and output_path.
+        workers (int): Number of worker processes (default: number of CPUs).
+        block_frames (int): Frames read and written at once by mono_to_stereo.
+        index_dir (str): Index built by chat_index.py, to read the timestamps from instead of the .cha files.
+
+    Returns:
+        list: (output path, error) of the pairs that failed.
+    """
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+        tasks = [(row['audio_path'], row['transcript_path'], row['output_path'], block_frames, index_dir) for row in csv.DictReader(f)]
+
+    failed = []
+    with Pool(workers) as pool:
+        for output_path, error in pool.imap_unordered(_convert_pair, tasks):
+            if error is None:
+                print(f" File successfully processed : {output_path}")
             else:
-                channel = 1
-            
-            for start_ms, end_ms in timestamps:
-                start_frame = int((start_ms / 1000) * frame_rate)
-                end_frame = int((end_ms / 1000) * frame_rate)
-                stereo_data[start_frame:end_frame, channel] = audio_data[start_frame:end_frame]
-        
-        stereo_data_flat = stereo_data.flatten().tobytes()
-
-        with wave.open(output_path, 'wb') as stereo_wav:
-                stereo_wav.setnchannels(2)
-                stereo_wav.setsampwidth(sample_width)
-                stereo_wav.setframerate(frame_rate)
-                stereo_wav.writeframes(stereo_data_flat)
+                print(f" ERROR: {output_path} - {error}")
+                failed.append((output_path, error))
+    print(f" {len(tasks) - len(failed)}/{len(tasks)} files converted")
+    return failed
 
 
 if __name__ == "__main__":
@@ -76,12 +202,25 @@ if __name__ == "__main__":
     parser.add_argument("--path_audio_file", type=str, default='')
     parser.add_argument("--path_transcript_file", type=str, default='')
     parser.add_argument("--output_stereo_wav", type=str, default='output.wav')
+    parser.add_argument("--manifest", type=str, default=None, help="CSV of audio_path,transcript_path,output_path to convert in batch")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes of the batch mode (default: number of CPUs)")
+    parser.add_argument("--block_frames", type=int, default=1 << 20, help="Frames read and written at once")
+    parser.add_argument("--index_dir", type=str, default=None, help="Index built by chat_index.py to read the timestamps from")
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
+    enable_instrumentation(args.instrument, args.profile_dir)
+
+    if args.manifest:
+        failed = convert_manifest(args.manifest, args.workers, args.block_frames, args.index_dir)
+        raise SystemExit(1 if failed else 0)
 
-    timestamps_dict = extract_timestamps(args.path_transcript_file)
-    overlaps = find_speech_overlaps(timestamps_dict)
+    with track_file(args.path_audio_file):
+        with stage("timestamps"):
+            timestamps_dict = load_timestamps(args.path_transcript_file, args.index_dir)
+        with stage("overlaps"):
+            overlaps = find_speech_overlaps(timestamps_dict)
 
-    mono_to_stereo(args.path_audio_file, timestamps_dict, args.output_stereo_wav)
+        mono_to_stereo(args.path_audio_file, timestamps_dict, args.output_stereo_wav, args.block_frames)
 
     # Display overlaps speakers and timestamps in the console
     for overlap in overlaps:
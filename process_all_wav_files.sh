@@ -3,48 +3,29 @@
 # Define the final CSV file 
 OUTPUT_CSV="data_vap_swb_all.csv"
 
-# Check if the CSV file already exists, otherwise create it 
-if [ ! -f "$OUTPUT_CSV" ]; then
-    echo "audio_path,start,end,vad_list,session,dataset" > "$OUTPUT_CSV"
-fi
-
 # Get the current directory containing .wav files
 DATA_DIR="$(pwd)"
 
-for wav_file in "$DATA_DIR"/*.wav; do
-    # Check if no .wav file is found
-    if [ ! -e "$wav_file" ]; then
-        echo " No .wav file found in $DATA_DIR"
-        exit 1
-    fi
-
-    echo "🔹Processing file: $wav_file"
-
-    # Ensure the file exists before proceeding
-    if [ ! -f "$wav_file" ]; then
-        echo " ERROR: File not found - $wav_file"
-        continue
-    fi
-
-    # Define a temporary file to store intermediate results
-    TEMP_CSV="temp_output.csv"
+# Number of worker processes and torch threads per worker (each worker loads the Silero model once)
+WORKERS="${WORKERS:-$(nproc)}"
+TORCH_THREADS="${TORCH_THREADS:-1}"
 
-    # Run the Python script `vap_gen_data.py` on the audio file
-    python vap_gen_data.py --path_audio_file "$wav_file" --output_csv "$TEMP_CSV"
+# Manifest and per-file shards: an interrupted run restarts where it stopped, unchanged files are not processed again
+BUILD_DIR="${BUILD_DIR:-.vap_build}"
 
-    # Verify if the temporary file was generated successfully
-    if [ ! -f "$TEMP_CSV" ]; then
-        echo " ERROR: temp_output.csv was not generated for $wav_file"
-        continue
-    fi
+# Per-file stage timings: run with VAP_INSTRUMENT=timings.jsonl (read by vap_batch.py and its workers),
+# then `python vap_instrument.py timings.jsonl` prints the time spent in each stage
 
-    # Append the results to the final CSV file 
-    tail -n +2 "$TEMP_CSV" >> "$OUTPUT_CSV"
+# Run `vap_gen_data.py` on every .wav file with a pool of workers and merge the rows into the final CSV file
+python vap_batch.py "$DATA_DIR" --output_csv "$OUTPUT_CSV" --version v1 --workers "$WORKERS" --torch_threads "$TORCH_THREADS" --build_dir "$BUILD_DIR"
 
-    # Delete the temporary file after use
-    rm "$TEMP_CSV"
-
-    echo " File successfully processed : $wav_file"
-done
+if [ $? -ne 0 ]; then
+    echo " ERROR: processing failed for $DATA_DIR"
+    exit 1
+fi
 
 echo " All files have been processed, and results are stored in $OUTPUT_CSV"
+
+if [ -n "$VAP_INSTRUMENT" ]; then
+    python vap_instrument.py "$VAP_INSTRUMENT"
+fi
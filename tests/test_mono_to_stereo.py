@@ -0,0 +1,135 @@
+import random
+import re
+import wave
+
+import numpy as np
+import pytest
+
+from chat_index import ChatIndex, build_index
+from mono_to_stereo import extract_timestamps, find_speech_overlaps, mono_to_stereo, speech_overlap_arrays
+
+
+# find_speech_overlaps and extract_timestamps before the sorted sweep and the line reader replaced them
+def original_find_speech_overlaps(timestamps_dic):
+    overlaps_list = []
+
+    dict_keys = list(timestamps_dic.keys())
+    for speaker1 in range(len(dict_keys)-1):
+        for speaker2 in range(speaker1 +1, len(dict_keys)):
+            for i in range(len(timestamps_dic[dict_keys[speaker1]])):
+                start1, end1 = timestamps_dic[dict_keys[speaker1]][i]
+                for j in range(len(timestamps_dic[dict_keys[speaker2]])):
+                    start2, end2 = timestamps_dic[dict_keys[speaker2]][j]
+
+                    if start1 < end2 and start2 < end1:
+                        overlaps_list.append(((dict_keys[speaker1], i), (dict_keys[speaker2], j)))
+    return overlaps_list
+
+
+def original_extract_timestamps(filepath):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    extracted_string = re.findall(r'\*(.*?):.*?\x15(.*?)\x15', content)
+    timestamps_dic = {}
+    for string in extracted_string:
+            num1, num2 = map(int, string[1].split('_'))
+            if string[0] not in timestamps_dic:
+                timestamps_dic[string[0]] = [(num1, num2)]
+            else:
+                timestamps_dic[string[0]].append((num1, num2))
+
+    return timestamps_dic
+
+
+def random_timestamps(rng, n_speakers):
+    # Utterances in ms, overlapping within and across speakers, with a few empty or reversed ones (transcription errors)
+    timestamps = {}
+    for speaker in ["CHI", "MOT", "FAT", "INV"][:n_speakers]:
+        timestamps[speaker] = []
+        for _ in range(rng.randint(0, 40)):
+            start = rng.randint(0, 60000)
+            timestamps[speaker].append((start, start + rng.choice([0, -500, rng.randint(1, 5000)])))
+    return timestamps
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_find_speech_overlaps_matches_nested_loops(seed):
+    rng = random.Random(seed)
+    timestamps = random_timestamps(rng, rng.randint(1, 4))
+    assert find_speech_overlaps(timestamps) == original_find_speech_overlaps(timestamps)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_overlap_totals(seed):
+    rng = random.Random(seed)
+    timestamps = random_timestamps(rng, 3)
+    overlaps = speech_overlap_arrays(timestamps)
+    speakers = overlaps["speakers"]
+    totals = np.zeros((len(speakers), len(speakers)), dtype=np.int64)
+    for (speaker1, i), (speaker2, j) in original_find_speech_overlaps(timestamps):
+        (start1, end1), (start2, end2) = timestamps[speaker1][i], timestamps[speaker2][j]
+        duration = max(min(end1, end2) - max(start1, start2), 0)
+        totals[speakers.index(speaker1), speakers.index(speaker2)] += duration
+        totals[speakers.index(speaker2), speakers.index(speaker1)] += duration
+    np.testing.assert_array_equal(overlaps["totals"], totals)
+
+
+CHAT_FILE = (
+    "@Begin\n"
+    "@Participants:\tCHI Target_Child, MOT Mother\n"
+    "*CHI:\tmore juice . \x15100_900\x15\n"
+    "%mor:\tqn|more n|juice .\n"
+    "*MOT:\tyou want more\n"
+    "\tjuice ? \x151000_2500\x15\n"
+    "*CHI:\tyes . \x152400_3000\x15\n"
+    "%com:\tpoints \x159999_10000\x15\n"
+    "*MOT:\tokay .\n"
+    "@End\n"
+)
+
+
+def test_extract_timestamps(tmp_path):
+    chat_path = tmp_path / "session.cha"
+    chat_path.write_text(CHAT_FILE, encoding="utf-8")
+    timestamps = extract_timestamps(str(chat_path))
+    assert timestamps == {"CHI": [(100, 900), (2400, 3000)], "MOT": [(1000, 2500)]}
+    # The original regex missed the bullet of the tier continued on a second line and took the one of %com
+    assert original_extract_timestamps(str(chat_path)) != timestamps
+
+
+def test_chat_index_timestamps(tmp_path):
+    chat_dir = tmp_path / "corpus" / "child1"
+    chat_dir.mkdir(parents=True)
+    for i in range(3):
+        (chat_dir / f"s{i}.cha").write_text(CHAT_FILE.replace("100_900", f"{100 + i}_900"), encoding="utf-8")
+    build_index(str(tmp_path / "corpus"), str(tmp_path / "index"), workers=1)
+
+    index = ChatIndex(str(tmp_path / "index"))
+    for i in range(3):
+        chat_path = str(chat_dir / f"s{i}.cha")
+        assert index.timestamps(chat_path) == extract_timestamps(chat_path)
+        assert index.timestamps(f"child1/s{i}.cha") == extract_timestamps(chat_path)
+
+
+def test_mono_to_stereo(tmp_path):
+    frame_rate = 1000
+    samples = np.arange(1, 5001, dtype=np.int16)
+    with wave.open(str(tmp_path / "mono.wav"), "wb") as mono_wav:
+        mono_wav.setnchannels(1)
+        mono_wav.setsampwidth(2)
+        mono_wav.setframerate(frame_rate)
+        mono_wav.writeframes(samples.tobytes())
+    timestamps = {"CHI": [(100, 900), (800, 1200)], "MOT": [(1000, 2500), (4500, 9000)]}
+
+    # Small blocks, so intervals cross block boundaries
+    mono_to_stereo(str(tmp_path / "mono.wav"), timestamps, str(tmp_path / "stereo.wav"), block_frames=333)
+    with wave.open(str(tmp_path / "stereo.wav"), "rb") as stereo_wav:
+        stereo = np.frombuffer(stereo_wav.readframes(stereo_wav.getnframes()), dtype=np.int16).reshape(-1, 2)
+
+    expected = np.zeros((len(samples), 2), dtype=np.int16)
+    for speaker, speaker_timestamps in timestamps.items():
+        channel = 0 if speaker == "CHI" else 1
+        for start_ms, end_ms in speaker_timestamps:
+            expected[start_ms:end_ms, channel] = samples[start_ms:end_ms]
+    np.testing.assert_array_equal(stereo, expected)
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+silero_vad = pytest.importorskip("silero_vad")
+get_speech_timestamps_from_probs = getattr(silero_vad, "get_speech_timestamps_from_probs", None)
+
+from vad_inference import SpeechSegmenter, _timestamps_from_probs, check_segmenter_params
+
+PARAMS = [
+    {},  # get_speech_timestamps defaults
+    {"threshold": 0.5, "min_speech_duration_ms": 50, "min_silence_duration_ms": 50, "speech_pad_ms": 10},  # vap_gen_data*.py
+    {"threshold": 0.3, "min_speech_duration_ms": 0, "min_silence_duration_ms": 0, "speech_pad_ms": 200},
+    {"threshold": 0.6, "neg_threshold": 0.2, "min_speech_duration_ms": 500, "min_silence_duration_ms": 300, "speech_pad_ms": 0},
+]
+
+
+def random_probs(rng, n_windows):
+    # Alternating speech and silence runs with noisy probabilities around the thresholds
+    probs = []
+    speech = rng.random() < 0.5
+    while len(probs) < n_windows:
+        probs += [min(1.0, max(0.0, rng.gauss(0.8 if speech else 0.15, 0.2))) for _ in range(rng.choice([1, 2, 5, rng.randint(1, 200)]))]
+        speech = not speech
+    return probs[:n_windows]
+
+
+def segment(probs, audio_length_samples, rng, **vad_params):
+    # Push the probabilities in chunks of random size, checking the horizon of the segmenter after each chunk
+    segmenter = SpeechSegmenter(**vad_params)
+    speeches = []
+    horizons = []
+    position = 0
+    while position < len(probs):
+        size = rng.choice([1, 7, rng.randint(1, 500)])
+        speeches += segmenter.push(probs[position:position + size])
+        horizons.append((len(speeches), segmenter.horizon()))
+        position += size
+    speeches += segmenter.flush(audio_length_samples)
+    for n_returned, horizon in horizons:
+        assert all(speech["start"] >= horizon for speech in speeches[n_returned:])
+    return speeches
+
+
+@pytest.mark.skipif(get_speech_timestamps_from_probs is None, reason="silero_vad without get_speech_timestamps_from_probs")
+@pytest.mark.parametrize("return_seconds", [False, True])
+@pytest.mark.parametrize("params", PARAMS)
+@pytest.mark.parametrize("seed", range(10))
+def test_segmenter_matches_silero(seed, params, return_seconds):
+    rng = random.Random(seed)
+    n_windows = rng.choice([0, 1, 3, rng.randint(1, 5000)])
+    probs = random_probs(rng, n_windows)
+    # The last window of the audio is often partial
+    audio_length_samples = max(0, n_windows * 512 - rng.randint(0, 511))
+
+    expected = get_speech_timestamps_from_probs(probs, audio_length_samples=audio_length_samples, return_seconds=return_seconds, **params)
+    assert segment(probs, audio_length_samples, rng, return_seconds=return_seconds, **params) == expected
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_segmenter_max_speech_split(seed):
+    # The max_speech split (silero_vad 5) does not depend on how the probabilities are pushed
+    rng = random.Random(seed)
+    probs = random_probs(rng, rng.randint(1, 5000))
+    params = {"max_speech_duration_s": rng.choice([1, 3.5, 10]), "min_speech_duration_ms": 50, "min_silence_duration_ms": 50, "speech_pad_ms": 10}
+    expected = _timestamps_from_probs(probs, return_seconds=True, **params)
+    assert segment(probs, len(probs) * 512, rng, return_seconds=True, **params) == expected
+    assert all(speech["end"] - speech["start"] <= params["max_speech_duration_s"] + 0.1 for speech in expected)
+
+
+def test_check_segmenter_params():
+    check_segmenter_params({"threshold": 0.5, "min_speech_duration_ms": 50, "min_silence_duration_ms": 50, "speech_pad_ms": 10})
+    with pytest.raises(ValueError):
+        check_segmenter_params({"min_silence_at_max_speech": 98})
+    if get_speech_timestamps_from_probs is not _timestamps_from_probs:
+        with pytest.raises(ValueError):
+            check_segmenter_params({"max_speech_duration_s": 10})
@@ -0,0 +1,142 @@
+import random
+
+import pytest
+
+from vad_windowing import StreamingWindower, timestamps_to_arrays, vad_data_format, vad_windows
+
+
+# vad_data_format of vap_gen_data.py and vap_gen_data_v2.py before vad_windows replaced them (the one of
+# vap_gen_data_v3.py is still vad_windowing.vad_data_format)
+def original_vad_data_format_v1(speaker1, speaker2, segment_id):
+    speaker1_segment_speech = []
+    speaker2_segment_speech = []
+    speech_id_speaker1 = 0
+    speech_id_speaker2 = 0
+
+    segment_start_time = segment_id * 20
+    segment_end_time = (segment_id + 1) * 20 + 2
+
+    while speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['start'] < segment_start_time:
+        speech_id_speaker1 += 1
+    while speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['end'] < segment_end_time:
+        speaker1_segment_speech.append([
+            round(speaker1[speech_id_speaker1]['start'] - segment_start_time, 6),
+            round(speaker1[speech_id_speaker1]['end'] - segment_start_time, 6)
+        ])
+        speech_id_speaker1 += 1
+
+    while speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['start'] < segment_start_time:
+        speech_id_speaker2 += 1
+    while speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['end'] < segment_end_time:
+        speaker2_segment_speech.append([
+            round(speaker2[speech_id_speaker2]['start'] - segment_start_time, 6),
+            round(speaker2[speech_id_speaker2]['end'] - segment_start_time, 6)
+        ])
+        speech_id_speaker2 += 1
+
+    return [speaker1_segment_speech, speaker2_segment_speech]
+
+
+def original_vad_data_format_v2(speaker1, speaker2, startAudioSegment):
+    speaker1_segment_speech = []
+    speaker2_segment_speech = []
+    speech_id_speaker1 = 0
+    speech_id_speaker2 = 0
+
+    while(speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['start']<startAudioSegment):
+        speech_id_speaker1+=1
+    while(speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['end']<startAudioSegment+20+2):
+        speaker1_segment_speech.append([speaker1[speech_id_speaker1]['start']-startAudioSegment, speaker1[speech_id_speaker1]['end']-startAudioSegment])
+        speech_id_speaker1+=1
+
+    while(speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['start']<startAudioSegment):
+        speech_id_speaker2+=1
+    while(speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['end']<startAudioSegment+20+2):
+        speaker2_segment_speech.append([speaker2[speech_id_speaker2]['start']-startAudioSegment, speaker2[speech_id_speaker2]['end']-startAudioSegment])
+        speech_id_speaker2+=1
+
+    return [speaker1_segment_speech, speaker2_segment_speech]
+
+
+def original_rows(speaker1, speaker2, duration_seconds, mode, recover):
+    # (start, end, vad_list) of each segment, as the loops of the original scripts generated them
+    rows = []
+    if mode == "v1":
+        for segment_id in range(int(duration_seconds // 19)):
+            rows.append((segment_id * 19, segment_id * 19 + 20, original_vad_data_format_v1(speaker1, speaker2, segment_id)))
+        return rows
+    start = 0
+    while (start < duration_seconds) if mode == "v2" else (start + 20 <= duration_seconds):
+        vad_data = original_vad_data_format_v2 if mode == "v2" else vad_data_format
+        rows.append((start, start + 20, vad_data(speaker1, speaker2, start)))
+        start += 20 - recover
+    return rows
+
+
+def random_speeches(rng, duration_seconds):
+    # Sorted disjoint speeches rounded to 0.1 s, as silero_vad returns them with return_seconds=True
+    speeches = []
+    time = round(rng.uniform(0, 3), 1)
+    while True:
+        start = round(time + rng.choice([0.1, 0.3, rng.uniform(0, 5)]), 1)
+        end = round(start + rng.choice([0.1, 0.2, rng.uniform(0, 8)]), 1)
+        if end > duration_seconds:
+            return speeches
+        speeches.append({'start': start, 'end': end})
+        time = end
+
+
+CASES = [(mode, recover, seed) for seed in range(8) for mode, recover in (("v1", 0), ("v2", 0), ("v2", 7), ("v3", 0), ("v3", 5), ("v3", 19))]
+
+
+@pytest.mark.parametrize("mode,recover,seed", CASES)
+def test_vad_windows_matches_original_vad_data_format(mode, recover, seed):
+    rng = random.Random(seed)
+    duration_seconds = rng.choice([0.0, 19.0, 20.0, 39.5, rng.uniform(0, 400)])
+    speaker1 = random_speeches(rng, duration_seconds)
+    speaker2 = random_speeches(rng, duration_seconds)
+
+    expected = original_rows(speaker1, speaker2, duration_seconds, mode, recover)
+    rows = list(vad_windows(speaker1, speaker2, duration_seconds, mode, recover))
+    assert rows == expected
+    # The .csv text of the rows, not only their values
+    assert str(rows) == str(expected)
+
+
+@pytest.mark.parametrize("mode,recover,seed", CASES[:12])
+def test_vad_windows_from_arrays(mode, recover, seed):
+    # (starts, ends) arrays, e.g. from the VAD cache, give the same segments as the silero_vad dicts
+    rng = random.Random(seed)
+    duration_seconds = rng.uniform(0, 300)
+    speaker1 = random_speeches(rng, duration_seconds)
+    speaker2 = random_speeches(rng, duration_seconds)
+
+    rows = list(vad_windows(timestamps_to_arrays(speaker1), timestamps_to_arrays(speaker2), duration_seconds, mode, recover))
+    assert str(rows) == str(list(vad_windows(speaker1, speaker2, duration_seconds, mode, recover)))
+
+
+@pytest.mark.parametrize("mode,recover,seed", CASES)
+def test_streaming_windower_matches_vad_windows(mode, recover, seed):
+    rng = random.Random(seed)
+    duration_seconds = rng.uniform(0, 400)
+    speakers = [random_speeches(rng, duration_seconds), random_speeches(rng, duration_seconds)]
+
+    # Add the speeches in time order, asking for the complete segments after each one
+    windower = StreamingWindower(mode, recover)
+    segments = []
+    queues = [list(speeches) for speeches in speakers]
+    while any(queues):
+        speaker = min((speaker for speaker in (0, 1) if queues[speaker]), key=lambda speaker: queues[speaker][0]['start'])
+        windower.add_speeches(speaker, [dict(queues[speaker].pop(0))])
+        horizon = min((queue[0]['start'] for queue in queues if queue), default=duration_seconds)
+        segments += windower.windows(horizon, min(horizon, duration_seconds))
+    segments += windower.finish(duration_seconds)
+
+    assert str(segments) == str(list(vad_windows(speakers[0], speakers[1], duration_seconds, mode, recover)))
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        list(vad_windows([], [], 60, mode="v4"))
+    with pytest.raises(ValueError):
+        StreamingWindower("v4")
@@ -0,0 +1,84 @@
+import os
+
+from vad_cache import audio_hash
+from vap_manifest import BuildManifest
+
+PARAMS = {"version": "v3", "recover": 0}
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def write_rows(self, rows):
+        self.rows += rows
+
+
+def build(manifest, audio_files, params=PARAMS):
+    # Record the files the manifest asks for, as vap_batch.process_corpus does; return the processed ones
+    processed = []
+    for audio_file in audio_files:
+        fingerprint = manifest.fingerprint(audio_file)
+        if manifest.is_done(audio_file, params, fingerprint):
+            continue
+        size, mtime_ns, sha256 = fingerprint
+        manifest.record(audio_file, params, (size, mtime_ns, sha256 or audio_hash(audio_file)), [[audio_file, 0, 20]])
+        processed.append(audio_file)
+    return processed
+
+
+def test_resume_and_changes(tmp_path):
+    audio_files = []
+    for i in range(3):
+        path = tmp_path / f"f{i}.wav"
+        path.write_bytes(bytes([i]) * 1000)
+        audio_files.append(str(path))
+    build_dir = str(tmp_path / "build")
+
+    assert build(BuildManifest(build_dir), audio_files) == audio_files
+    # A new build reads the manifest back: nothing to do
+    assert build(BuildManifest(build_dir), audio_files) == []
+
+    # Touched but unchanged: hashed, not processed again
+    os.utime(audio_files[0], ns=(1, 1))
+    assert build(BuildManifest(build_dir), audio_files) == []
+    # Same size, new content, and new size
+    with open(audio_files[1], "r+b") as f:
+        f.write(b"\xff")
+    with open(audio_files[2], "ab") as f:
+        f.write(b"\x00")
+    assert build(BuildManifest(build_dir), audio_files) == audio_files[1:]
+    # Other parameters
+    assert build(BuildManifest(build_dir), audio_files, dict(PARAMS, recover=3)) == audio_files
+
+    manifest = BuildManifest(build_dir)
+    manifest.compact()
+    with open(manifest.manifest_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == len(audio_files)
+    writer = ListWriter()
+    assert manifest.merge(audio_files[::-1], writer) == len(audio_files)
+    assert writer.rows == [[audio_file, 0, 20] for audio_file in audio_files[::-1]]
+
+
+def test_missing_shard_is_rebuilt(tmp_path):
+    path = tmp_path / "f.wav"
+    path.write_bytes(b"\x01" * 100)
+    build_dir = str(tmp_path / "build")
+    manifest = BuildManifest(build_dir)
+    build(manifest, [str(path)])
+    os.remove(manifest.shard_path(str(path)))
+    assert build(BuildManifest(build_dir), [str(path)]) == [str(path)]
+
+
+def test_cut_manifest_line(tmp_path):
+    # A line cut by a crash is ignored, the file it described is processed again
+    path = tmp_path / "f.wav"
+    path.write_bytes(b"\x01" * 100)
+    build_dir = str(tmp_path / "build")
+    build(BuildManifest(build_dir), [str(path)])
+    manifest_path = os.path.join(build_dir, "manifest.jsonl")
+    with open(manifest_path, encoding="utf-8") as f:
+        line = f.read()
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        f.write(line[:len(line) // 2])
+    assert build(BuildManifest(build_dir), [str(path)]) == [str(path)]
@@ -0,0 +1,106 @@
+import csv
+import os
+import stat
+
+import numpy as np
+import pytest
+
+from vap_output import CSV_HEADER, load_npy, open_writer, vad_frames
+
+ROWS = [
+    ["a.wav", 0, 20, [[[0.5, 1.2], [3.0, 20.0]], []], 0, "swb"],
+    ["a.wav", 19, 39, [[[0.0, 2.5]], [[10.29, 11.0]]], 0, "swb"],
+    ["b.wav", 0, 20, [[], [[0.0, 21.5]]], 1, "childes"],
+]
+
+
+def speeches_of_window(data, window):
+    # vad_list of a window read back from speeches.npy and offsets.npy
+    offsets = data["offsets"]
+    return [data["speeches"][offsets[2 * window + speaker]:offsets[2 * window + speaker + 1]].tolist() for speaker in (0, 1)]
+
+
+@pytest.mark.parametrize("frame_rate", [None, 50])
+def test_npy_round_trip(tmp_path, frame_rate):
+    output_dir = str(tmp_path / "out")
+    with open_writer("npy", output_dir, frame_rate) as writer:
+        writer.write_rows(ROWS[:2])
+        writer.write_rows(ROWS[2:])
+
+    data = load_npy(output_dir)
+    windows = data["windows"]
+    meta = data["meta"]
+    assert len(windows) == len(ROWS)
+    for window, (audio_path, start, end, vad_list, session, dataset) in enumerate(ROWS):
+        assert meta["audio_paths"][windows["audio_id"][window]] == audio_path
+        assert meta["datasets"][windows["dataset_id"][window]] == dataset
+        assert (windows["start"][window], windows["end"][window], windows["session"][window]) == (start, end, session)
+        assert speeches_of_window(data, window) == vad_list
+        if frame_rate is not None:
+            np.testing.assert_array_equal(data["frames"][window], vad_frames(vad_list, frame_rate))
+    assert ("frames" in data) == (frame_rate is not None)
+
+    # Read without memory mapping
+    assert load_npy(output_dir, mmap=False)["windows"].tolist() == windows.tolist()
+
+
+def test_vad_frames():
+    frames = vad_frames([[[0.29, 0.5]], [[21.9, 30.0]]], frame_rate=100)
+    assert frames.shape == (2, 2200)
+    # 0.29 * 100 = 28.999999999999996 is still frame 29
+    assert np.flatnonzero(frames[0]).tolist() == list(range(29, 50))
+    assert np.flatnonzero(frames[1]).tolist() == list(range(2190, 2200))
+
+
+def test_csv(tmp_path):
+    path = str(tmp_path / "out.csv")
+    with open_writer("csv", path) as writer:
+        writer.write_rows(ROWS)
+    with open(path, newline="", encoding="utf-8") as f:
+        lines = list(csv.reader(f))
+    assert lines[0] == CSV_HEADER
+    assert lines[1:] == [[str(value) for value in row] for row in ROWS]
+    with pytest.raises(ValueError):
+        open_writer("csv", path, frame_rate=50)
+
+
+def test_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "out.parquet")
+    with open_writer("parquet", path, 50) as writer:
+        writer.write_rows(ROWS)
+    table = pq.read_table(path).to_pylist()
+    assert [[row[name] for name in CSV_HEADER] for row in table] == ROWS
+    frames = np.fromfile(f"{path}.frames.u8", dtype=np.uint8).reshape(len(ROWS), 2, -1)
+    np.testing.assert_array_equal(frames[1], vad_frames(ROWS[1][3], 50))
+
+
+@pytest.mark.parametrize("output_format", ["csv", "npy", "parquet"])
+def test_failed_write_keeps_previous_output(tmp_path, output_format):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"out.{output_format}")
+    frame_rate = None if output_format == "csv" else 50
+    with open_writer(output_format, path, frame_rate) as writer:
+        writer.write_rows(ROWS[:1])
+    before = {name: open(os.path.join(root, name), "rb").read() for root, _, names in os.walk(tmp_path) for name in names}
+
+    with pytest.raises(KeyboardInterrupt):
+        with open_writer(output_format, path, frame_rate) as writer:
+            writer.write_rows(ROWS)
+            raise KeyboardInterrupt
+
+    after = {name: open(os.path.join(root, name), "rb").read() for root, _, names in os.walk(tmp_path) for name in names}
+    assert after == before
+
+
+def test_output_mode(tmp_path):
+    # Outputs are written through temporary files, they still get the mode of a plain open()
+    umask = os.umask(0o022)
+    try:
+        path = str(tmp_path / "out.csv")
+        with open_writer("csv", path) as writer:
+            writer.write_rows(ROWS)
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+# Silero ships the same model as TorchScript ("jit") and ONNX ("onnx")
+BACKENDS = ("jit", "onnx")
+
+# One intra-op and one inter-op thread per process: the corpus is processed by many parallel workers (one per
+# core), so each model must not start threads of its own; raise them only for a single process on a free machine
+DEFAULT_INTRA_OP_THREADS = 1
+DEFAULT_INTER_OP_THREADS = 1
+
+
+def load_vad_model(backend="jit", intra_op_threads=DEFAULT_INTRA_OP_THREADS, inter_op_threads=DEFAULT_INTER_OP_THREADS):
+    """
+    Load the Silero VAD model with an explicit number of CPU threads.
+
+    Parameters:
+        backend (str): 'jit' (TorchScript, run by torch) or 'onnx' (ONNX Runtime).
+        intra_op_threads (int): Threads used inside one operator.
+        inter_op_threads (int): Threads running independent operators in parallel.
+
+    Returns:
+        The model, called as model(chunk, sampling_rate) by both backends.
+    """
+    import torch
+    from silero_vad import load_silero_vad
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown VAD backend {backend!r}, expected one of {BACKENDS}")
+    # torch also runs the pre/post-processing of the onnx backend
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+        pass  # Can only be set once per process, before any parallel work
+
+    if backend == "jit":
+        return load_silero_vad()
+
+    import onnxruntime
+    from importlib import resources
+
+    model = load_silero_vad(onnx=True)
+    # The wrapper of silero_vad fixes 1 thread of each kind, open the session again with the requested ones
+    opts = onnxruntime.SessionOptions()
+    opts.intra_op_num_threads = intra_op_threads
+    opts.inter_op_num_threads = inter_op_threads
+    model_path = str(resources.files("silero_vad.data").joinpath("silero_vad.onnx"))
+    model.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"], sess_options=opts)
+    return model
+
+
+def backend_info(backend="jit", intra_op_threads=DEFAULT_INTRA_OP_THREADS, inter_op_threads=DEFAULT_INTER_OP_THREADS):
+    # Description of the VAD backend, recorded next to the outputs
+    from importlib.metadata import version, PackageNotFoundError
+
+    info = {"backend": backend, "intra_op_threads": intra_op_threads, "inter_op_threads": inter_op_threads}
+    for package in ("silero-vad", "torch", "onnxruntime" if backend == "onnx" else None):
+        if package is not None:
+            try:
+                info[package] = version(package)
+            except PackageNotFoundError:
+                info[package] = None
+    return info
+
+
+def write_backend_info(output, info):
+    # Write the backend description as <output>.vad_backend.json (output can be a file or a directory)
+    info_path = f"{output.rstrip(os.sep)}.vad_backend.json"
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=1)
+    return info_path
+
+
+def benchmark(backends=BACKENDS, threads=(1,), audio_seconds=60, n_streams=2, repeats=3, seed=0):
+    """
+    Speed of each backend on the local CPU: n_streams channels of audio_seconds of noise scored by speech_probs
+    as vap_gen_data*.py score the two channels of a file (one batch, or one stream after another on TorchScript
+    below vad_inference.JIT_MIN_BATCH streams).
+
+    Returns:
+        list: (backend, threads, audio seconds per second of computation) of each configuration, best of repeats.
+    """
+    import torch
+    from vad_inference import speech_probs
+
+    rng = np.random.default_rng(seed)
+    streams = [torch.from_numpy((0.1 * rng.standard_normal(audio_seconds * 16000)).astype(np.float32)) for _ in range(n_streams)]
+    results = []
+    for backend in backends:
+        for n_threads in threads:
+            model = load_vad_model(backend, n_threads, 1)
+            speech_probs([stream[:16000] for stream in streams], model)  # Warm up
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                speech_probs(streams, model)
+                best = min(best, time.perf_counter() - start)
+            results.append((backend, n_threads, n_streams * audio_seconds / best))
+            print(f" {backend:4} {n_threads:2} thread(s): {n_streams * audio_seconds / best:8.1f} s of audio per second")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the throughput of the Silero VAD backends on this CPU")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--threads", nargs="+", type=int, default=[1], help="Intra-op thread counts to try")
+    parser.add_argument("--seconds", type=int, default=60, help="Duration of each of the 2 synthetic channels")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    benchmark(args.backends, args.threads, args.seconds, repeats=args.repeats)
@@ -0,0 +1,113 @@
+import os
+import json
+import hashlib
+import numpy as np
+from atomic_file import atomic_path
+
+CACHE_VERSION = 2  # Bump when the cached content changes, old entries are then ignored
+
+
+def audio_hash(audio_file, block_size=1 << 20):
+    # SHA-256 of the audio file content (independent of its path and mtime)
+    sha = hashlib.sha256()
+    with open(audio_file, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class VadCache:
+    """
+    On-disk cache of the Silero VAD timestamps of each recording, so a new windowing (--recover, segment
+    length, v2/v3) never runs the VAD again.
+
+    One compressed .npz per recording holds the duration and the start/end arrays (seconds) of every channel.
+    Its name is derived from the audio content hash, the sampling rate and the VAD parameters; the channel
+    index is part of the array names inside the file.
+
+    Parameters:
+        cache_dir (str): Directory of the cache (created if needed).
+        max_size_mb (float): When set, least recently used entries are evicted above this size.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=None):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = None if max_size_mb is None else int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, audio_file, vad_params, sampling_rate=16000, content_hash=None):
+        # Cache key of one recording for a given VAD configuration (content_hash: audio_hash of the file when already known)
+        description = json.dumps({
+            "version": CACHE_VERSION,
+            "audio": content_hash or audio_hash(audio_file),
+            "sampling_rate": sampling_rate,
+            "vad_params": vad_params,
+        }, sort_keys=True)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def load(self, key):
+        """
+        Return (duration in seconds, [(starts, ends) of each channel]) or None if the recording is not cached.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                duration_seconds = float(entry["duration"])
+                channels = [(entry[f"starts_{i}"], entry[f"ends_{i}"]) for i in range(int(entry["n_channels"]))]
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        # Mark as recently used for the eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # Evicted by another worker meanwhile
+        return duration_seconds, channels
+
+    def save(self, key, duration_seconds, channels):
+        """
+        Store the timestamps of a recording.
+
+        Parameters:
+            key (str): Key returned by VadCache.key.
+            duration_seconds (float): Duration of the recording.
+            channels (list): silero_vad timestamps (in seconds) or (starts, ends) arrays of each channel.
+        """
+        arrays = {"duration": np.float64(duration_seconds), "n_channels": np.int64(len(channels))}
+        for i, speeches in enumerate(channels):
+            if isinstance(speeches, tuple):
+                starts, ends = speeches
+            else:
+                starts = [speech["start"] for speech in speeches]
+                ends = [speech["end"] for speech in speeches]
+            arrays[f"starts_{i}"] = np.asarray(starts, dtype=np.float64)
+            arrays[f"ends_{i}"] = np.asarray(ends, dtype=np.float64)
+
+        # Write to a temporary file then rename, so concurrent workers never read a partial entry
+        with atomic_path(self._path(key)) as tmp_path, open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        self.evict()
+
+    def evict(self):
+        # Remove least recently used entries until the cache fits in max_size_bytes
+        if self.max_size_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue  # Removed by another worker
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,299 @@
+import math
+import torch
+from audio_ingest import load_pcm, channel_tensor
+from vap_instrument import stage
+
+# Smallest number of streams worth a batch on the TorchScript model: on one CPU core a batch of 2 is slower
+# than 2 single streams (60 s streams: 2.2 s vs 1.6 s), 3 break even and 4 are faster (2.4 s vs 3.2 s).
+# The ONNX model is faster batched from 2 streams on (0.8 s vs 1.3 s).
+JIT_MIN_BATCH = 4
+
+
+def speech_probs(streams, model, sampling_rate=16000, window_size_samples=512):
+    """
+    Speech probability of every window of several audio streams, scored together as one batch.
+
+    The streams (e.g. the two channels of a conversation, or the channels of several files) go through the
+    Silero model as a batch of len(streams) rows, one window at a time, so the model keeps a separate
+    recurrent state for each stream. Shorter streams are zero-padded the way get_speech_timestamps pads the
+    last window, and the probabilities after their end are dropped. Fewer than JIT_MIN_BATCH streams are
+    scored one after another on the TorchScript model, where such small batches are slower.
+
+    Parameters:
+        streams (list): 1-D float32 tensors sampled at sampling_rate.
+        model: Silero VAD model (torch JIT or ONNX wrapper).
+
+    Returns:
+        list: One list of probabilities per stream.
+    """
+    if 1 < len(streams) < JIT_MIN_BATCH and isinstance(model, torch.jit.ScriptModule):
+        return [probs for stream in streams for probs in speech_probs([stream], model, sampling_rate, window_size_samples)]
+
+    n_windows = [math.ceil(len(stream) / window_size_samples) for stream in streams]
+    batch = torch.zeros(len(streams), max(n_windows, default=0) * window_size_samples)
+    for i, stream in enumerate(streams):
+        batch[i, :len(stream)] = stream
+
+    model.reset_states()
+    probs = window_probs(batch, model, sampling_rate, window_size_samples)
+    return [probs[i, :n_windows[i]].tolist() for i in range(len(streams))]
+
+
+def window_probs(batch, model, sampling_rate=16000, window_size_samples=512):
+    """
+    Speech probabilities of a (n_streams, n_samples) batch, n_samples being a multiple of window_size_samples.
+    The model state is not reset, so consecutive blocks of the same streams can be given one after another.
+
+    Returns:
+        tensor: (n_streams, n_windows) probabilities.
+    """
+    probs = []
+    with torch.no_grad():
+        for start in range(0, batch.shape[1], window_size_samples):
+            probs.append(model(batch[:, start:start + window_size_samples], sampling_rate).reshape(-1))
+    return torch.stack(probs, dim=1) if probs else torch.zeros(batch.shape[0], 0)
+
+
+# get_speech_timestamps parameters implemented by SpeechSegmenter
+SEGMENTER_PARAMS = ("threshold", "min_speech_duration_ms", "max_speech_duration_s", "min_silence_duration_ms", "speech_pad_ms",
+                    "neg_threshold")
+
+
+def check_segmenter_params(vad_params):
+    """
+    Raise a ValueError if SpeechSegmenter would not give the speeches of get_speech_timestamps_from_probs for
+    vad_params: parameters it does not implement (e.g. min_silence_at_max_speech of silero_vad 6), or a finite
+    max_speech_duration_s while the installed silero_vad splits long speeches its own way.
+    """
+    unknown = sorted(set(vad_params) - set(SEGMENTER_PARAMS))
+    if unknown:
+        raise ValueError(f"SpeechSegmenter does not implement {unknown}, supported parameters: {SEGMENTER_PARAMS}")
+    if vad_params.get("max_speech_duration_s", float("inf")) != float("inf") and get_speech_timestamps_from_probs is not _timestamps_from_probs:
+        raise ValueError("A finite max_speech_duration_s is split the silero_vad 5 way by SpeechSegmenter, which can differ "
+                         "from the installed silero_vad: streaming needs max_speech_duration_s=inf")
+
+
+class SpeechSegmenter:
+    """
+    Incremental version of the get_speech_timestamps post-processing (thresholds, min_speech/min_silence,
+    max_speech split, speech_pad). Window probabilities are pushed as they come and each speech is returned
+    as soon as no later probability can change it, so long recordings never keep all their probabilities.
+
+    For max_speech_duration_s=inf (the default, used by vap_gen_data*.py) the speeches are the ones of every
+    silero_vad version; the max_speech split follows silero_vad 5 (see check_segmenter_params).
+    """
+
+    def __init__(self, sampling_rate=16000, threshold=0.5, min_speech_duration_ms=250, max_speech_duration_s=float("inf"),
+                 min_silence_duration_ms=100, speech_pad_ms=30, return_seconds=False, time_resolution=1, neg_threshold=None):
+        self.sampling_rate = sampling_rate
+        self.window_size_samples = 512 if sampling_rate == 16000 else 256
+        self.threshold = threshold
+        self.neg_threshold = max(threshold - 0.15, 0.01) if neg_threshold is None else neg_threshold
+        self.min_speech_samples = sampling_rate * min_speech_duration_ms / 1000
+        self.speech_pad_samples = sampling_rate * speech_pad_ms / 1000
+        self.max_speech_samples = sampling_rate * max_speech_duration_s - self.window_size_samples - 2 * self.speech_pad_samples
+        self.min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
+        self.min_silence_samples_at_max_speech = sampling_rate * 98 / 1000
+        self.return_seconds = return_seconds
+        self.time_resolution = time_resolution
+
+        self.n_windows = 0
+        self.triggered = False
+        self.current_speech = {}
+        self.temp_end = 0  # To save potential segment end (and tolerate some silence)
+        self.prev_end = self.next_start = 0  # To save potential segment limits in case of maximum segment size reached
+        self._pending = None  # Last speech, its end depends on the start of the next one (speech_pad)
+        self._ready = []  # Padded speeches (in samples) not returned yet
+
+    def push(self, speech_probs):
+        """
+        Process the next window probabilities, return the speeches that are now final.
+        """
+        for speech_prob in speech_probs:
+            self._step(speech_prob)
+            self.n_windows += 1
+
+        # The next speech can not start before this sample: if it is far enough, the pending speech gets its full padding
+        last_sample = (self.n_windows - 1) * self.window_size_samples
+        earliest_start = self.current_speech['start'] if self.triggered else last_sample
+        if self._pending is not None and earliest_start - self._pending['end'] >= 2 * self.speech_pad_samples:
+            self._pending['end'] = int(self._pending['end'] + self.speech_pad_samples)
+            self._ready.append(self._pending)
+            self._pending = None
+        return self._pop_ready(last_sample)
+
+    def flush(self, audio_length_samples):
+        """
+        End of the audio, return the remaining speeches.
+        """
+        if self.current_speech and (audio_length_samples - self.current_speech['start']) > self.min_speech_samples:
+            self.current_speech['end'] = audio_length_samples
+            self._add(self.current_speech)
+        self.current_speech = {}
+        self.triggered = False
+        if self._pending is not None:
+            self._pending['end'] = int(min(audio_length_samples, self._pending['end'] + self.speech_pad_samples))
+            self._ready.append(self._pending)
+            self._pending = None
+        return self._pop_ready(audio_length_samples, end_of_audio=True)
+
+    def horizon(self):
+        """
+        Every speech not returned yet starts at or after this time (in samples, or seconds if return_seconds).
+        """
+        starts = [(self.n_windows * self.window_size_samples) - self.speech_pad_samples]
+        if self.triggered:
+            starts.append(self.current_speech['start'] - self.speech_pad_samples)
+        if self._pending is not None:
+            starts.append(self._pending['start'])
+        if self._ready:
+            starts.append(self._ready[0]['start'])
+        horizon = max(0, min(starts))
+        if self.return_seconds:
+            # Rounding to time_resolution can move a start up to half a resolution step earlier
+            return horizon / self.sampling_rate - 0.5 * 10 ** -self.time_resolution
+        return horizon
+
+    def _add(self, speech):
+        # Speech padding, the same as the last loop of get_speech_timestamps
+        if self._pending is None:
+            speech['start'] = int(max(0, speech['start'] - self.speech_pad_samples))
+        else:
+            silence_duration = speech['start'] - self._pending['end']
+            if silence_duration < 2 * self.speech_pad_samples:
+                self._pending['end'] += int(silence_duration // 2)
+                speech['start'] = int(max(0, speech['start'] - silence_duration // 2))
+            else:
+                # The next speech starts inside the audio, so the padded end does too
+                self._pending['end'] = int(self._pending['end'] + self.speech_pad_samples)
+                speech['start'] = int(max(0, speech['start'] - self.speech_pad_samples))
+            self._ready.append(self._pending)
+        self._pending = speech
+
+    def _pop_ready(self, audio_length_samples, end_of_audio=False):
+        if not self.return_seconds:
+            speeches, self._ready = self._ready, []
+            return speeches
+
+        # In seconds, an end is clipped to the audio length: only return it once the rounding can not exceed it
+        speeches = []
+        audio_length_seconds = audio_length_samples / self.sampling_rate
+        while self._ready:
+            end = round(self._ready[0]['end'] / self.sampling_rate, self.time_resolution)
+            if not end_of_audio and end > audio_length_seconds:
+                break
+            speech_dict = self._ready.pop(0)
+            speech_dict['start'] = max(round(speech_dict['start'] / self.sampling_rate, self.time_resolution), 0)
+            speech_dict['end'] = min(end, audio_length_seconds)
+            speeches.append(speech_dict)
+        return speeches
+
+    def _step(self, speech_prob):
+        # One iteration of the get_speech_timestamps loop
+        current_sample = self.window_size_samples * self.n_windows
+        if (speech_prob >= self.threshold) and self.temp_end:
+            self.temp_end = 0
+            if self.next_start < self.prev_end:
+                self.next_start = current_sample
+
+        if (speech_prob >= self.threshold) and not self.triggered:
+            self.triggered = True
+            self.current_speech['start'] = current_sample
+            return
+
+        if self.triggered and current_sample - self.current_speech['start'] > self.max_speech_samples:
+            if self.prev_end:
+                self.current_speech['end'] = self.prev_end
+                self._add(self.current_speech)
+                self.current_speech = {}
+                if self.next_start < self.prev_end:  # Previously reached silence (< neg_thres) and is still not speech (< thres)
+                    self.triggered = False
+                else:
+                    self.current_speech['start'] = self.next_start
+                self.prev_end = self.next_start = self.temp_end = 0
+            else:
+                self.current_speech['end'] = current_sample
+                self._add(self.current_speech)
+                self.current_speech = {}
+                self.prev_end = self.next_start = self.temp_end = 0
+                self.triggered = False
+                return
+
+        if (speech_prob < self.neg_threshold) and self.triggered:
+            if not self.temp_end:
+                self.temp_end = current_sample
+            if current_sample - self.temp_end > self.min_silence_samples_at_max_speech:  # Avoid cutting in very short silence
+                self.prev_end = self.temp_end
+            if current_sample - self.temp_end < self.min_silence_samples:
+                return
+            self.current_speech['end'] = self.temp_end
+            if (self.current_speech['end'] - self.current_speech['start']) > self.min_speech_samples:
+                self._add(self.current_speech)
+            self.current_speech = {}
+            self.prev_end = self.next_start = self.temp_end = 0
+            self.triggered = False
+
+
+def _timestamps_from_probs(speech_probs, sampling_rate=16000, return_seconds=False, time_resolution=1, audio_length_samples=None,
+                           **vad_params):
+    """
+    Speech timestamps of one stream from its window probabilities, for silero_vad versions without
+    get_speech_timestamps_from_probs (see SpeechSegmenter).
+    """
+    segmenter = SpeechSegmenter(sampling_rate, return_seconds=return_seconds, time_resolution=time_resolution, **vad_params)
+    if audio_length_samples is None:
+        audio_length_samples = len(speech_probs) * segmenter.window_size_samples
+    return segmenter.push(speech_probs) + segmenter.flush(audio_length_samples)
+
+
+try:
+    from silero_vad import get_speech_timestamps_from_probs
+except ImportError:
+    get_speech_timestamps_from_probs = _timestamps_from_probs
+
+
+def batched_speech_timestamps(streams, model, sampling_rate=16000, return_seconds=True, **vad_params):
+    """
+    get_speech_timestamps of several streams with one batched pass of the model (see speech_probs).
+
+    Parameters:
+        streams (list): 1-D float32 tensors sampled at sampling_rate (8kHz or 16kHz).
+        model: Silero VAD model.
+        vad_params: Parameters of get_speech_timestamps (threshold, min_speech_duration_ms, ...).
+
+    Returns:
+        list: The timestamps of each stream, as get_speech_timestamps returns them.
+    """
+    if sampling_rate not in (8000, 16000):
+        raise ValueError("Silero VAD supports 8000 and 16000 sampling rates")
+    window_size_samples = 512 if sampling_rate == 16000 else 256
+    with stage("vad"):
+        probs = speech_probs(streams, model, sampling_rate, window_size_samples)
+    with stage("segmentation"):
+        return [
+            get_speech_timestamps_from_probs(stream_probs, sampling_rate=sampling_rate, return_seconds=return_seconds,
+                                             audio_length_samples=len(stream), **vad_params)
+            for stream, stream_probs in zip(streams, probs)
+        ]
+
+
+def stereo_speech_timestamps(audio_files, model, **vad_params):
+    """
+    Timestamps of both channels of several stereo audio files, with all their channels in one batch (scored one
+    after another on TorchScript below JIT_MIN_BATCH channels, e.g. for a single file, see speech_probs).
+
+    Returns:
+        list: (duration in seconds, speaker1 timestamps, speaker2 timestamps) of each file.
+    """
+    streams = []
+    durations = []
+    for audio_file in audio_files:
+        with stage("decode"):
+            samples, frame_rate = load_pcm(audio_file)
+        # Conversion to float32 and resampling to 16kHz when needed
+        with stage("resample"):
+            streams += [channel_tensor(samples, 0, frame_rate), channel_tensor(samples, 1, frame_rate)]
+        durations.append(len(samples) / frame_rate)
+
+    timestamps = batched_speech_timestamps(streams, model, **vad_params)
+    return [(duration, timestamps[2 * i], timestamps[2 * i + 1]) for i, duration in enumerate(durations)]
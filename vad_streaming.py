@@ -0,0 +1,280 @@
+import copy
+import time
+import asyncio
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from audio_ingest import iter_pcm_blocks, to_float32
+from vad_inference import JIT_MIN_BATCH, SpeechSegmenter, check_segmenter_params, stereo_speech_timestamps, window_probs
+from vap_instrument import add_audio_seconds, stage
+from vad_windowing import StreamingWindower, vad_windows
+
+SAMPLING_RATE = 16000
+WINDOW_SIZE_SAMPLES = 512
+
+
+class LiveVad:
+    """
+    Incremental VAD labels of a live two-channel stream.
+
+    Stereo PCM chunks of any length are pushed as they arrive; both channels go through the model with their
+    recurrent state kept between chunks (as a batch of 2, or one after another with a copy of the model per
+    channel on TorchScript, see vad_inference.JIT_MIN_BATCH), the speeches are finalized as the probabilities come
+    (SpeechSegmenter) and the segments are returned as soon as they are complete (StreamingWindower), in the
+    vad_list format of vad_data_format.
+
+    The latency is set by the configuration: a speech is final once min_silence_duration_ms (+ speech_pad_ms)
+    of silence follow it, and a segment once its 20 seconds (+ 2 seconds of lookahead for v1/v2) are covered,
+    so the hop between segments (20 - recover seconds for v3) sets how often labels come out. Chunks shorter
+    than a model window (32 ms) only wait for the next one.
+
+    Parameters:
+        model: Silero VAD model (see vad_backend.load_vad_model).
+        mode (str): Windowing of vap_gen_data.py ('v1'), vap_gen_data_v2.py ('v2') or vap_gen_data_v3.py ('v3').
+        recover (int): Overlap in seconds between consecutive segments (v2 and v3 only).
+        vad_params: Parameters of get_speech_timestamps (threshold, min_speech_duration_ms, ...).
+    """
+
+    def __init__(self, model, mode="v3", recover=0, **vad_params):
+        # The speeches must be the ones of the offline pipeline (get_speech_timestamps_from_probs)
+        check_segmenter_params(vad_params)
+        # On TorchScript 2 streams are faster one after another, each channel then needs its own recurrent state
+        self.models = [model, copy.deepcopy(model)] if 2 < JIT_MIN_BATCH and isinstance(model, torch.jit.ScriptModule) else [model]
+        self.segmenters = [SpeechSegmenter(SAMPLING_RATE, return_seconds=True, **vad_params) for _ in range(2)]
+        self.windower = StreamingWindower(mode, recover)
+        self.n_frames = 0  # Frames given to the model
+        self._pending = np.zeros((0, 2), dtype=np.float32)  # Less than one model window
+        for channel_model in self.models:
+            channel_model.reset_states()
+
+    @property
+    def duration(self):
+        # Seconds of audio processed so far
+        return self.n_frames / SAMPLING_RATE
+
+    def push(self, chunk):
+        """
+        Process the next samples.
+
+        Parameters:
+            chunk (ndarray): (n_frames, 2) 16kHz PCM, integer or float in [-1, 1].
+
+        Returns:
+            tuple: (speeches, segments) finalized by this chunk: (speaker, start, end) of each speech in
+            seconds and (start, end, vad_list) of each segment.
+        """
+        with stage("resample"):
+            audio = np.concatenate([self._pending, to_float32(chunk[:, :2])])
+            n_ready = len(audio) // WINDOW_SIZE_SAMPLES * WINDOW_SIZE_SAMPLES
+            self._pending = audio[n_ready:]
+            if n_ready == 0:
+                return [], []
+            batch = torch.from_numpy(np.ascontiguousarray(audio[:n_ready].T))
+        return self._process(batch, n_ready)
+
+    def close(self):
+        """
+        End of the stream: return the remaining (speeches, segments).
+        """
+        n_frames = len(self._pending)
+        speeches = []
+        segments = []
+        if n_frames:
+            # The last window is zero-padded like the last window of get_speech_timestamps
+            audio = F.pad(torch.from_numpy(np.ascontiguousarray(self._pending.T)), (0, WINDOW_SIZE_SAMPLES - n_frames))
+            speeches, segments = self._process(audio, n_frames)
+            self._pending = self._pending[:0]
+        with stage("segmentation"):
+            for speaker, segmenter in enumerate(self.segmenters):
+                speeches += self._add_speeches(speaker, segmenter.flush(self.n_frames))
+        with stage("windowing"):
+            return speeches, segments + self.windower.finish(self.duration)
+
+    def _process(self, audio, n_frames):
+        with stage("vad"):
+            if len(self.models) == 1:
+                probs = window_probs(audio, self.models[0], SAMPLING_RATE, WINDOW_SIZE_SAMPLES).tolist()
+            else:
+                probs = [window_probs(audio[channel:channel + 1], channel_model, SAMPLING_RATE, WINDOW_SIZE_SAMPLES)[0].tolist()
+                         for channel, channel_model in enumerate(self.models)]
+        self.n_frames += n_frames
+        speeches = []
+        with stage("segmentation"):
+            for speaker, segmenter in enumerate(self.segmenters):
+                speeches += self._add_speeches(speaker, segmenter.push(probs[speaker]))
+            horizon = min(segmenter.horizon() for segmenter in self.segmenters)
+        with stage("windowing"):
+            return speeches, self.windower.windows(horizon, self.duration)
+
+    def _add_speeches(self, speaker, speeches):
+        self.windower.add_speeches(speaker, speeches)
+        return [(speaker, speech['start'], speech['end']) for speech in speeches]
+
+
+def stream_windows(audio_file, model, mode="v3", recover=0, block_seconds=60, **vad_params):
+    """
+    Segments of a stereo .wav file computed block by block, for recordings too long to be loaded at once.
+
+    Each block of both channels goes through the model (see LiveVad) without resetting its state, the
+    speeches are finalized as the probabilities come (SpeechSegmenter) and a segment is yielded as soon as
+    its 20 seconds (plus lookahead) are covered (StreamingWindower). The memory only depends on block_seconds,
+    and the segments are the ones csv_rows gives for the whole file.
+
+    Parameters:
+        audio_file (str): 16kHz stereo .wav file.
+        model: Silero VAD model.
+        mode (str): Windowing of vap_gen_data.py ('v1'), vap_gen_data_v2.py ('v2') or vap_gen_data_v3.py ('v3').
+        recover (int): Overlap in seconds between consecutive segments (v2 and v3 only).
+        block_seconds (float): Duration of audio read at once.
+        vad_params: Parameters of get_speech_timestamps (threshold, min_speech_duration_ms, ...).
+
+    Yields:
+        tuple: (start, end, vad_list) of each segment.
+    """
+    # Blocks are a whole number of model windows, so the probabilities do not depend on the block size
+    block_frames = max(1, int(block_seconds * SAMPLING_RATE / WINDOW_SIZE_SAMPLES)) * WINDOW_SIZE_SAMPLES
+    frame_rate, n_channels, blocks = iter_pcm_blocks(audio_file, block_frames)
+    if frame_rate != SAMPLING_RATE:
+        raise ValueError(f"Streaming needs {SAMPLING_RATE}Hz audio, {audio_file} is {frame_rate}Hz")
+    if n_channels < 2:
+        raise ValueError(f"{audio_file} is not a stereo file")
+
+    live = LiveVad(model, mode, recover, **vad_params)
+    while True:
+        # Stages never span a yield, so the time of the consumer (e.g. writing the rows) is not counted here
+        with stage("decode"):
+            block = next(blocks, None)
+        if block is None:
+            break
+        add_audio_seconds(len(block) / frame_rate)
+        yield from live.push(block)[1]
+    yield from live.close()[1]
+
+
+def verify_streaming(audio_file, model, mode="v3", recover=0, block_seconds=(0.5, 7, 60), **vad_params):
+    """
+    Check that stream_windows gives the segments of the offline pipeline (stereo_speech_timestamps then
+    vad_windows, as csv_rows) for each block size, compared both as values and as .csv text.
+
+    Returns:
+        list: The block sizes whose segments differ (empty when streaming matches).
+    """
+    duration_seconds, speaker1, speaker2 = stereo_speech_timestamps([audio_file], model, **vad_params)[0]
+    offline = list(vad_windows(speaker1, speaker2, duration_seconds, mode, recover))
+    mismatches = []
+    for seconds in block_seconds:
+        streamed = list(stream_windows(audio_file, model, mode, recover, seconds, **vad_params))
+        if streamed != offline or str(streamed) != str(offline):
+            mismatches.append(seconds)
+        print(f" {seconds:6} s blocks: {len(streamed)} segments, {'identical' if seconds not in mismatches else 'DIFFERENT'} "
+              f"({len(offline)} offline)")
+    return mismatches
+
+
+def live_labels(chunks, model, mode="v3", recover=0, **vad_params):
+    """
+    Labels of a live stereo stream (see LiveVad), as events in the order they are final:
+    ('speech', (speaker, start, end)) and ('window', (start, end, vad_list)).
+
+    Parameters:
+        chunks: Iterable of (n_frames, 2) 16kHz PCM chunks (e.g. wav_replay).
+    """
+    live = LiveVad(model, mode, recover, **vad_params)
+    for chunk in chunks:
+        yield from _events(*live.push(chunk))
+    yield from _events(*live.close())
+
+
+async def alive_labels(chunks, model, mode="v3", recover=0, **vad_params):
+    """
+    asyncio version of live_labels: chunks is an async iterable (e.g. awav_replay), the model runs in the
+    default executor so the event loop keeps serving the source while a chunk is scored.
+    """
+    loop = asyncio.get_running_loop()
+    live = LiveVad(model, mode, recover, **vad_params)
+    async for chunk in chunks:
+        for event in _events(*await loop.run_in_executor(None, live.push, chunk)):
+            yield event
+    for event in _events(*live.close()):
+        yield event
+
+
+def _events(speeches, segments):
+    return [("speech", speech) for speech in speeches] + [("window", segment) for segment in segments]
+
+
+def wav_replay(audio_file, chunk_ms=20, realtime=True):
+    """
+    Replay a 16kHz stereo .wav file as a live source (in place of a microphone), in chunks of chunk_ms.
+
+    Parameters:
+        realtime (bool): Wait so that each chunk comes when it would be recorded.
+    """
+    frame_rate, n_channels, blocks = iter_pcm_blocks(audio_file, max(1, int(chunk_ms * SAMPLING_RATE / 1000)))
+    if frame_rate != SAMPLING_RATE or n_channels < 2:
+        raise ValueError(f"Live replay needs a {SAMPLING_RATE}Hz stereo file, {audio_file} is {frame_rate}Hz with {n_channels} channel(s)")
+    start_time = time.monotonic()
+    n_frames = 0
+    for block in blocks:
+        n_frames += len(block)
+        if realtime:
+            time.sleep(max(0.0, start_time + n_frames / SAMPLING_RATE - time.monotonic()))
+        yield block
+
+
+async def awav_replay(audio_file, chunk_ms=20, realtime=True):
+    # asyncio version of wav_replay
+    frame_rate, n_channels, blocks = iter_pcm_blocks(audio_file, max(1, int(chunk_ms * SAMPLING_RATE / 1000)))
+    if frame_rate != SAMPLING_RATE or n_channels < 2:
+        raise ValueError(f"Live replay needs a {SAMPLING_RATE}Hz stereo file, {audio_file} is {frame_rate}Hz with {n_channels} channel(s)")
+    start_time = time.monotonic()
+    n_frames = 0
+    for block in blocks:
+        n_frames += len(block)
+        if realtime:
+            await asyncio.sleep(max(0.0, start_time + n_frames / SAMPLING_RATE - time.monotonic()))
+        yield block
+
+
+if __name__ == "__main__":
+    from vad_backend import BACKENDS, load_vad_model
+    from vap_gen_data_v3 import VAD_PARAMS
+
+    parser = argparse.ArgumentParser(description="Replay a stereo .wav file as a live stream and print its labels with their latency")
+    parser.add_argument("path_audio_file", type=str, help="16kHz stereo .wav file")
+    parser.add_argument("--chunk_ms", type=int, default=20, help="Duration of the chunks of the replay")
+    parser.add_argument("--recover", type=int, default=19, help="Overlap between consecutive 20 s windows (19: one window per second)")
+    parser.add_argument("--min_silence_duration_ms", type=int, default=VAD_PARAMS["min_silence_duration_ms"])
+    parser.add_argument("--backend", choices=BACKENDS, default="jit")
+    parser.add_argument("--fast", action="store_true", help="Do not wait between chunks (no latency measure)")
+    parser.add_argument("--use_asyncio", action="store_true", help="Use the asyncio API")
+    parser.add_argument("--verify", action="store_true", help="Only check that streaming gives the offline segments (see verify_streaming)")
+    args = parser.parse_args()
+
+    model = load_vad_model(args.backend)
+    vad_params = dict(VAD_PARAMS, min_silence_duration_ms=args.min_silence_duration_ms)
+    if args.verify:
+        for mode in ("v1", "v2", "v3"):
+            print(f" {mode}:")
+            if verify_streaming(args.path_audio_file, model, mode, 0 if mode == "v1" else args.recover, **vad_params):
+                raise SystemExit(1)
+        raise SystemExit(0)
+    start_time = time.monotonic()
+
+    def show(kind, item):
+        # Latency: time since the audio the label depends on was replayed
+        end = item[2] if kind == "speech" else item[1]
+        latency = "" if args.fast else f" (latency {time.monotonic() - start_time - end:.3f} s)"
+        print(f" {kind}: {item}{latency}")
+
+    if args.use_asyncio:
+        async def main():
+            async for kind, item in alive_labels(awav_replay(args.path_audio_file, args.chunk_ms, not args.fast), model,
+                                                 recover=args.recover, **vad_params):
+                show(kind, item)
+        asyncio.run(main())
+    else:
+        for kind, item in live_labels(wav_replay(args.path_audio_file, args.chunk_ms, not args.fast), model,
+                                      recover=args.recover, **vad_params):
+            show(kind, item)
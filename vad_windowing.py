@@ -0,0 +1,244 @@
+import numpy as np
+
+SEGMENT_LENGTH = 20  # Size of a training segment (seconds)
+LOOKAHEAD = 2  # Future voice activity kept after a segment by v1 and v2 (seconds)
+V1_STEP = 19  # Fixed step between two segments of vap_gen_data.py
+
+MODES = ("v1", "v2", "v3")
+
+
+def timestamps_to_arrays(speech_timestamps):
+    """
+    Convert silero_vad output (list of {'start', 'end'} dicts, in seconds) into sorted start and end arrays.
+    A (starts, ends) tuple is returned unchanged, so already converted (or cached) timestamps can be given directly.
+    """
+    if isinstance(speech_timestamps, tuple):
+        return speech_timestamps
+    if not speech_timestamps:
+        return np.empty(0), np.empty(0)
+    starts = np.array([speech['start'] for speech in speech_timestamps])
+    ends = np.array([speech['end'] for speech in speech_timestamps])
+    return starts, ends
+
+
+def _iter_windows(mode, recover=0):
+    # Endless sequence of (segment id, row start, vad offset) of vap_gen_data*.py
+    segment_id = 0
+    start = 0
+    while True:
+        if mode == "v1":
+            yield segment_id, segment_id * V1_STEP, segment_id * SEGMENT_LENGTH
+        else:
+            yield segment_id, start, start
+            start += SEGMENT_LENGTH - recover
+        segment_id += 1
+
+
+def _window_in_audio(mode, segment_id, start, duration_seconds):
+    # True if the segment is generated for an audio file of this duration
+    if mode == "v1":
+        return segment_id < int(duration_seconds // V1_STEP)
+    if mode == "v2":
+        return start < duration_seconds
+    # Ensure no extra segment is added at the end
+    return start + SEGMENT_LENGTH <= duration_seconds
+
+
+def _window_span_end(mode, offset):
+    # Last time (exclusive) whose speeches can be part of the vad_list of a segment
+    if mode == "v3":
+        return offset + SEGMENT_LENGTH
+    return offset + SEGMENT_LENGTH + LOOKAHEAD
+
+
+def window_starts(duration_seconds, mode="v3", recover=0):
+    """
+    Return (row starts, vad offsets) of every segment of an audio file, as generated by vap_gen_data*.py.
+    The vad offset is the time the vad_list is relative to; it only differs from the row start in v1
+    (rows every 19 seconds, vad_list every 20 seconds).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown windowing mode {mode!r}, expected one of {MODES}")
+    starts = []
+    offsets = []
+    for segment_id, start, offset in _iter_windows(mode, recover):
+        if not _window_in_audio(mode, segment_id, start, duration_seconds):
+            break
+        starts.append(start)
+        offsets.append(offset)
+    return np.array(starts, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+def _window_bounds(starts, ends, offsets, mode):
+    # Index range [lo, hi) of the speeches of every window, found with one binary search per window instead of a scan from index 0
+    if mode == "v3":
+        # First speech ending after the window start, last speech starting before the window end
+        lo = np.searchsorted(ends, offsets, side="right")
+        hi = np.searchsorted(starts, offsets + SEGMENT_LENGTH, side="left")
+    else:
+        # First speech starting after the window start, stop at the first speech ending after the lookahead
+        lo = np.searchsorted(starts, offsets, side="left")
+        hi = np.searchsorted(ends, offsets + SEGMENT_LENGTH + LOOKAHEAD, side="left")
+    return lo, np.maximum(lo, hi)
+
+
+def _format_speeches(starts, ends, offset, mode):
+    # Same arithmetic as the original vad_data_format of each script, so the .csv output is identical
+    segment_speech = []
+    if mode == "v1":
+        for start, end in zip(starts, ends):
+            segment_speech.append([round(start - offset, 6), round(end - offset, 6)])
+    elif mode == "v2":
+        for start, end in zip(starts, ends):
+            segment_speech.append([start - offset, end - offset])
+    else:
+        for start, end in zip(starts, ends):
+            start_time = max(0, start - offset)
+            end_time = min(SEGMENT_LENGTH, end - offset)
+            if end_time > start_time or (end_time - start_time) >= 0.05:
+                segment_speech.append([round(start_time, 6), round(end_time, 6)])
+    return segment_speech
+
+
+def vad_data_format(speaker1, speaker2, startAudioSegment):
+    """
+    Convert Silero VAD output into VAD data format for VAP-Realtime training.
+    Ensures proper segment inclusion and prevents missing short segments.
+
+    Original per-segment implementation of vap_gen_data_v3.py (one scan of the timestamps per segment), kept as
+    the reference of the v3 windowing of vad_windows and as the baseline of vap_benchmark.py.
+    """
+
+    speaker1_segment_speech = []
+    speaker2_segment_speech = []
+    speech_id_speaker1 = 0
+    speech_id_speaker2 = 0
+
+    # Ensure all valid speech segments are included
+    while speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['end'] <= startAudioSegment:
+        speech_id_speaker1 += 1
+
+    while speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['start'] < startAudioSegment + 20:
+        start_time = max(0, speaker1[speech_id_speaker1]['start'] - startAudioSegment)
+        end_time = min(20, speaker1[speech_id_speaker1]['end'] - startAudioSegment)
+
+        # Ensure very short segments are not ignored
+        if end_time > start_time or (end_time - start_time) >= 0.05:
+            speaker1_segment_speech.append([round(start_time, 6), round(end_time, 6)])
+        speech_id_speaker1 += 1
+
+    while speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['end'] <= startAudioSegment:
+        speech_id_speaker2 += 1
+
+    while speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['start'] < startAudioSegment + 20:
+        start_time = max(0, speaker2[speech_id_speaker2]['start'] - startAudioSegment)
+        end_time = min(20, speaker2[speech_id_speaker2]['end'] - startAudioSegment)
+
+        if end_time > start_time or (end_time - start_time) >= 0.05:
+            speaker2_segment_speech.append([round(start_time, 6), round(end_time, 6)])
+        speech_id_speaker2 += 1
+
+    return [speaker1_segment_speech, speaker2_segment_speech]
+
+
+def vad_windows(speaker1, speaker2, duration_seconds, mode="v3", recover=0):
+    """
+    Generate every segment of an audio file in one pass over the speeches of both speakers.
+
+    Parameters:
+        speaker1, speaker2: silero_vad timestamps (in seconds) or (starts, ends) arrays of each speaker.
+        duration_seconds (float): Duration of the audio file.
+        mode (str): Windowing of vap_gen_data.py ('v1'), vap_gen_data_v2.py ('v2') or vap_gen_data_v3.py ('v3').
+        recover (int): Overlap in seconds between consecutive segments (v2 and v3 only).
+
+    Yields:
+        tuple: (start, end, vad_list), vad_list being the value vad_data_format returns for this segment.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown windowing mode {mode!r}, expected one of {MODES}")
+
+    row_starts, offsets = window_starts(duration_seconds, mode, recover)
+    speakers = []
+    for speaker in (speaker1, speaker2):
+        starts, ends = timestamps_to_arrays(speaker)
+        lo, hi = _window_bounds(starts, ends, offsets, mode)
+        # The original Python values keep the .csv text identical to the one of vad_data_format
+        if isinstance(speaker, tuple):
+            starts, ends = starts.tolist(), ends.tolist()
+        else:
+            starts, ends = [speech['start'] for speech in speaker], [speech['end'] for speech in speaker]
+        speakers.append((starts, ends, lo.tolist(), hi.tolist()))
+
+    for i, (row_start, offset) in enumerate(zip(row_starts.tolist(), offsets.tolist())):
+        vad_list = [
+            _format_speeches(starts[lo[i]:hi[i]], ends[lo[i]:hi[i]], offset, mode)
+            for starts, ends, lo, hi in speakers
+        ]
+        yield row_start, row_start + SEGMENT_LENGTH, vad_list
+
+
+class StreamingWindower:
+    """
+    Segments of vad_windows for speeches that arrive while the audio is read (see vad_streaming).
+
+    Speeches of each speaker are added in time order; a segment is returned as soon as every speech that can
+    be part of its vad_list is known, and speeches no later segment needs are dropped, so the memory does not
+    depend on the length of the recording.
+
+    Parameters:
+        mode (str): Windowing of vap_gen_data.py ('v1'), vap_gen_data_v2.py ('v2') or vap_gen_data_v3.py ('v3').
+        recover (int): Overlap in seconds between consecutive segments (v2 and v3 only).
+    """
+
+    def __init__(self, mode="v3", recover=0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown windowing mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.speakers = ([], [])  # Speeches (silero_vad dicts, in seconds) still needed by the next segments
+        self._windows = _iter_windows(mode, recover)
+        self._next_window = next(self._windows)
+
+    def add_speeches(self, speaker, speeches):
+        # Add the next speeches of one speaker (0 or 1)
+        self.speakers[speaker].extend(speeches)
+
+    def windows(self, horizon, duration_seconds):
+        """
+        Return the segments that are complete.
+
+        Parameters:
+            horizon (float): Every speech not added yet starts at or after this time.
+            duration_seconds (float): Duration of the audio read so far (or of the whole file at the end).
+
+        Returns:
+            list: (start, end, vad_list) of each complete segment, as vad_windows generates them.
+        """
+        windows = []
+        while True:
+            segment_id, start, offset = self._next_window
+            if not _window_in_audio(self.mode, segment_id, start, duration_seconds) or _window_span_end(self.mode, offset) > horizon:
+                break
+            windows.append((start, start + SEGMENT_LENGTH, [self._vad_list(speeches, offset) for speeches in self.speakers]))
+            self._next_window = next(self._windows)
+            self._drop_speeches(self._next_window[2])
+        return windows
+
+    def finish(self, duration_seconds):
+        # End of the audio: every speech is known, return the remaining segments
+        return self.windows(float("inf"), duration_seconds)
+
+    def _vad_list(self, speeches, offset):
+        starts = [speech['start'] for speech in speeches]
+        ends = [speech['end'] for speech in speeches]
+        lo, hi = _window_bounds(np.array(starts), np.array(ends), np.array([offset]), self.mode)
+        return _format_speeches(starts[lo[0]:hi[0]], ends[lo[0]:hi[0]], offset, self.mode)
+
+    def _drop_speeches(self, next_offset):
+        # Speeches before the next segment are never used again (segments only move forward)
+        for speeches in self.speakers:
+            n_dropped = 0
+            for speech in speeches:
+                if (speech['end'] > next_offset) if self.mode == "v3" else (speech['start'] >= next_offset):
+                    break
+                n_dropped += 1
+            del speeches[:n_dropped]
@@ -0,0 +1,296 @@
+import os
+import glob
+import argparse
+import importlib
+from contextlib import nullcontext
+from multiprocessing import Pool
+from audio_ingest import load_sphere, write_wav
+from vad_backend import BACKENDS, DEFAULT_INTER_OP_THREADS, DEFAULT_INTRA_OP_THREADS, backend_info, load_vad_model, write_backend_info
+from vad_cache import VadCache, audio_hash
+from vad_inference import stereo_speech_timestamps
+from vap_instrument import add_audio_seconds, add_instrumentation_arguments, enable_instrumentation, stage, track_file, untracked
+from vap_manifest import BuildManifest
+from vap_output import FORMATS, open_writer
+
+# Scripts able to produce the .csv rows of one audio file
+VERSIONS = {
+    "v1": "vap_gen_data",
+    "v2": "vap_gen_data_v2",
+    "v3": "vap_gen_data_v3",
+}
+
+# State of each worker process, set once by _init_worker
+_worker = {}
+
+
+def collect_audio_files(inputs, sph=False):
+    """
+    Expand the command line inputs into a list of .wav and .sph files.
+
+    Parameters:
+        inputs (list): Directories (every .wav inside), .wav or .sph files, or text files listing one audio path per line.
+        sph (bool): Also take every .sph file below the directories, as convert_sph_to_wav.sh finds them, except
+            the ones whose .wav copy is already taken (same name in the directory).
+    """
+    audio_files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            wav_files = sorted(glob.glob(os.path.join(path, "*.wav")))
+            audio_files.extend(wav_files)
+            if sph:
+                converted = {os.path.splitext(os.path.basename(wav_file))[0] for wav_file in wav_files}
+                audio_files.extend(sph_file for sph_file in sorted(glob.glob(os.path.join(path, "**", "*.sph"), recursive=True))
+                                   if os.path.splitext(os.path.basename(sph_file))[0] not in converted)
+        elif path.endswith((".wav", ".sph")):
+            audio_files.append(path)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                audio_files.extend(line.strip() for line in f if line.strip())
+    return audio_files
+
+
+def _init_worker(version, recover, torch_threads, cache_dir=None, cache_max_mb=None, wav_dir=None, backend="jit",
+                 inter_op_threads=DEFAULT_INTER_OP_THREADS, hash_files=False):
+    _worker["module"] = importlib.import_module(VERSIONS[version])
+    _worker["kwargs"] = {} if version == "v1" else {"recover": recover}
+    _worker["backend"] = (backend, torch_threads, inter_op_threads)
+    _worker["model"] = None
+    _worker["cache"] = None if cache_dir is None else VadCache(cache_dir, cache_max_mb)
+    _worker["wav_dir"] = wav_dir
+    # The content hash is needed by the build manifest and the VAD cache key
+    _worker["hash_files"] = hash_files or cache_dir is not None
+
+
+def _model():
+    # Load the Silero model once per worker, when a file first needs it (not at all when every file is cached),
+    # it is then reused for every file. The load is not charged to that file
+    if _worker["model"] is None:
+        with untracked(), stage("load_model"):
+            _worker["model"] = load_vad_model(*_worker["backend"])
+    return _worker["model"]
+
+
+def _speech_timestamps(audio_files, hashes):
+    # Timestamps of both channels of each file (from the VAD cache when possible), the channels of all missing files go through the model as one batch
+    # (one after another on jit when fewer than vad_inference.JIT_MIN_BATCH)
+    # hashes gives the content hash of each file, computed once by the worker for the manifest and the cache
+    module = _worker["module"]
+    cache = _worker["cache"]
+    results = {}
+    keys = {}
+    if cache is not None:
+        for audio_file in audio_files:
+            # The backends give slightly different probabilities, so the backend is part of the key
+            with stage("cache"):
+                keys[audio_file] = cache.key(audio_file, dict(module.VAD_PARAMS, backend=_worker["backend"][0]), content_hash=hashes[audio_file])
+                cached = cache.load(keys[audio_file])
+            if cached is not None:
+                duration_seconds, (speaker1, speaker2) = cached
+                results[audio_file] = duration_seconds, speaker1, speaker2
+
+    missing = [audio_file for audio_file in audio_files if audio_file not in results]
+    if missing:
+        results.update(zip(missing, stereo_speech_timestamps(missing, _model(), **module.VAD_PARAMS)))
+        if cache is not None:
+            for audio_file in missing:
+                duration_seconds, speaker1, speaker2 = results[audio_file]
+                with stage("cache"):
+                    cache.save(keys[audio_file], duration_seconds, [speaker1, speaker2])
+    return results
+
+
+def _content_hash(audio_file, known_hash=None):
+    # SHA-256 of an input file, read once here for both the build manifest and the VAD cache key
+    # (unless the parent already knows it from the manifest)
+    if known_hash is not None or not _worker["hash_files"]:
+        return known_hash
+    with stage("hash"):
+        return audio_hash(audio_file)
+
+
+def _wav_copy(audio_file):
+    # Path of the audio used for the rows: .sph files are decoded once and written to wav_dir when asked,
+    # otherwise they are decoded in memory by the VAD stage and the rows point to the .sph file
+    wav_dir = _worker["wav_dir"]
+    if wav_dir is None or not audio_file.lower().endswith(".sph"):
+        return audio_file
+    wav_path = os.path.join(wav_dir, os.path.splitext(os.path.basename(audio_file))[0] + ".wav")
+    with stage("wav_copy"):
+        write_wav(wav_path, *load_sphere(audio_file))
+    return wav_path
+
+
+def _process_files(audio_files, known_hashes=None):
+    # Return [(audio_file, rows, error, content hash)] so one broken file does not stop the whole corpus
+    # known_hashes gives the content hash of the files whose manifest fingerprint is still valid
+    # The files of a batch share the VAD pass, so they are measured together (one record per batch)
+    with track_file(audio_files[0] if len(audio_files) == 1 else audio_files):
+        return _process_batch(audio_files, known_hashes or {})
+
+
+def _process_task(task):
+    # imap passes one argument: (audio_files, known_hashes)
+    return _process_files(*task)
+
+
+def _process_batch(audio_files, known_hashes):
+    module = _worker["module"]
+    try:
+        hashes = {audio_file: _content_hash(audio_file, known_hashes.get(audio_file)) for audio_file in audio_files}
+        audio_paths = {audio_file: _wav_copy(audio_file) for audio_file in audio_files}
+        # The cache key of a .sph file is its own content hash, also when the rows point to its .wav copy
+        timestamps = _speech_timestamps(list(audio_paths.values()), {audio_paths[audio_file]: hashes[audio_file] for audio_file in audio_files})
+    except Exception as e:
+        if len(audio_files) > 1:
+            # Retry file by file to only report the broken ones
+            return [result for audio_file in audio_files for result in _process_files([audio_file], known_hashes)]
+        return [(audio_files[0], [], f"{type(e).__name__}: {e}", None)]
+
+    results = []
+    for audio_file in audio_files:
+        audio_path = audio_paths[audio_file]
+        duration_seconds, speaker1, speaker2 = timestamps[audio_path]
+        add_audio_seconds(duration_seconds)
+        try:
+            with stage("windowing"):
+                rows = module.csv_rows(audio_path, duration_seconds, speaker1, speaker2, **_worker["kwargs"])
+        except Exception as e:
+            results.append((audio_file, [], f"{type(e).__name__}: {e}", None))
+            continue
+        results.append((audio_file, rows, None, hashes[audio_file]))
+    return results
+
+
+def process_corpus(audio_files, output, version="v3", recover=0, workers=None, torch_threads=DEFAULT_INTRA_OP_THREADS, cache_dir=None, cache_max_mb=None,
+                   files_per_batch=1, output_format="csv", frame_rate=None, build_dir=None, wav_dir=None, backend="jit",
+                   inter_op_threads=DEFAULT_INTER_OP_THREADS):
+    """
+    Compute the VAP training rows of every audio file on a process pool and merge them into one output.
+
+    Parameters:
+        audio_files (list): Paths of the stereo .wav or .sph files (.sph files are decoded in memory, see audio_ingest.load_sphere).
+        output (str): Path of the merged output (.csv or .parquet file, directory for npy).
+        version (str): Which vap_gen_data script produces the rows ('v1', 'v2' or 'v3').
+        recover (int): Overlap in seconds between consecutive segments (v2 and v3 only).
+        workers (int): Number of worker processes (default: number of CPUs).
+        torch_threads (int): Number of intra-op threads of each worker (see vad_backend for the default).
+        cache_dir (str): Directory of the VAD timestamps cache (see vad_cache), None to always run the VAD.
+        cache_max_mb (float): Size limit of the cache, None for no limit.
+        files_per_batch (int): Number of files whose channels go through the model as one batch (2 channels per file,
+            jit only batches from 2 files on, see vad_inference.JIT_MIN_BATCH).
+        output_format (str): One of vap_output.FORMATS.
+        frame_rate (int): When set (npy and parquet), also store the frame-level activity of each segment at this rate.
+        build_dir (str): When set, the rows of each file are kept in a shard recorded by a manifest (see
+            vap_manifest): only new or changed files are processed, then all shards are merged into the output.
+        wav_dir (str): When set, the decoded .sph files are also written there as 16kHz .wav files, and the rows
+            point to them instead of the .sph files.
+        backend (str): VAD inference backend, one of vad_backend.BACKENDS; recorded as <output>.vad_backend.json.
+        inter_op_threads (int): Number of inter-op threads of each worker.
+
+    Returns:
+        list: (audio_file, error) of the files that failed.
+    """
+    workers = workers or os.cpu_count()
+    failed = []
+    if wav_dir is not None:
+        os.makedirs(wav_dir, exist_ok=True)
+
+    todo = audio_files
+    manifest = None
+    if build_dir is not None:
+        manifest = BuildManifest(build_dir)
+        params = {"version": version, "recover": recover, "vad_params": importlib.import_module(VERSIONS[version]).VAD_PARAMS,
+                  "backend": backend}
+        if wav_dir is not None:
+            params["wav_dir"] = wav_dir  # The rows of .sph files point to wav_dir
+        fingerprints = {}
+        todo = []
+        for audio_file in audio_files:
+            try:
+                fingerprints[audio_file] = manifest.fingerprint(audio_file)
+            except OSError as e:
+                print(f" ERROR: {audio_file} - {type(e).__name__}: {e}")
+                failed.append((audio_file, f"{type(e).__name__}: {e}"))
+                continue
+            if not manifest.is_done(audio_file, params, fingerprints[audio_file]):
+                todo.append(audio_file)
+        print(f" {len(fingerprints) - len(todo)} files already built, {len(todo)} to process")
+
+    # Without manifest the rows are written as they come, with one they go to the shards and are merged at the end.
+    # The writers only replace the output once complete (see vap_output), a crash leaves the previous one
+    with open_writer(output_format, output, frame_rate) if manifest is None else nullcontext() as writer:
+        if todo:
+            with Pool(workers, initializer=_init_worker, initargs=(version, recover, torch_threads, cache_dir, cache_max_mb, wav_dir, backend,
+                                                                          inter_op_threads, manifest is not None)) as pool:
+                # imap keeps the input order, so the merged output does not depend on the scheduling
+                batches = [todo[i:i + files_per_batch] for i in range(0, len(todo), files_per_batch)]
+                # Files whose fingerprint already has a hash (unchanged but built with other parameters, or touched) are not hashed again
+                known_hashes = {} if manifest is None else {audio_file: fingerprint[2] for audio_file, fingerprint in fingerprints.items() if fingerprint[2] is not None}
+                tasks = [(batch, {audio_file: known_hashes[audio_file] for audio_file in batch if audio_file in known_hashes}) for batch in batches]
+                results = (result for batch_results in pool.imap(_process_task, tasks) for result in batch_results)
+                for audio_file, rows, error, content_hash in results:
+                    if error is not None:
+                        print(f" ERROR: {audio_file} - {error}")
+                        failed.append((audio_file, error))
+                        continue
+                    with stage("write"):
+                        if manifest is None:
+                            writer.write_rows(rows)
+                        else:
+                            # The files without a known hash are hashed by the workers, not here
+                            size, mtime_ns, _ = fingerprints[audio_file]
+                            manifest.record(audio_file, params, (size, mtime_ns, content_hash), rows)
+                    print(f" File successfully processed : {audio_file}")
+
+    if manifest is not None:
+        manifest.compact()
+        failed_files = {audio_file for audio_file, _ in failed}
+        with stage("merge"), open_writer(output_format, output, frame_rate) as writer:
+            manifest.merge([audio_file for audio_file in audio_files if audio_file not in failed_files], writer)
+
+    # The backend is recorded next to the outputs
+    write_backend_info(output, backend_info(backend, torch_threads, inter_op_threads))
+    return failed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="+", help="Directories of .wav files, .wav/.sph files or text files listing audio paths")
+    parser.add_argument("--sph", action="store_true", help="Also process the .sph files below the input directories (not the ones converted to a .wav there)")
+    parser.add_argument("--output", "--output_csv", type=str, default="data_vap_swb_all.csv", help="Output file (directory for npy)")
+    parser.add_argument("--output_format", choices=FORMATS, default="csv", help="csv (as vap_gen_data*.py), npy arrays or parquet")
+    parser.add_argument("--frame_rate", type=int, default=None, help="Also store frame-level activity at this rate, e.g. 50 (npy and parquet)")
+    parser.add_argument("--version", choices=sorted(VERSIONS), default="v3", help="vap_gen_data script used to build the rows")
+    parser.add_argument("--recover", type=int, default=0, help="An integer between 0 and 19 (v2 and v3 only).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--backend", choices=BACKENDS, default="jit", help="VAD inference backend (torch JIT or ONNX Runtime)")
+    parser.add_argument("--intra_op_threads", "--torch_threads", dest="torch_threads", type=int, default=DEFAULT_INTRA_OP_THREADS,
+                        help="CPU threads inside one operator, per worker")
+    parser.add_argument("--inter_op_threads", type=int, default=DEFAULT_INTER_OP_THREADS, help="CPU threads running operators in parallel, per worker")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Cache of the VAD timestamps, re-windowing a cached corpus does not run the VAD")
+    parser.add_argument("--cache_max_mb", type=float, default=None, help="Size limit of the VAD cache (least recently used entries are evicted)")
+    parser.add_argument("--build_dir", type=str, default=None, help="Manifest and per-file shards: re-runs only process new or changed files")
+    parser.add_argument("--wav_dir", type=str, default=None, help="Also write the decoded .sph files there as 16kHz .wav files (rows then point to them)")
+    parser.add_argument("--files_per_batch", type=int, default=1, help="Number of files whose channels are scored as one batch by the VAD model (jit batches from 2 files, see vad_inference.JIT_MIN_BATCH)")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    if args.frame_rate is not None and args.output_format == "csv":
+        parser.error("--frame_rate needs --output_format npy or parquet")
+    # Set before the pool starts, so the workers record their files too
+    enable_instrumentation(args.instrument, args.profile_dir)
+
+    if not 0 <= args.recover <= 19:
+        raise argparse.ArgumentTypeError(f"{args.recover} is not between 0 and 19")
+    if args.version == "v1" and args.recover:
+        raise argparse.ArgumentTypeError("--recover is not supported by v1 (fixed step of 19 seconds)")
+
+    audio_files = collect_audio_files(args.inputs, args.sph)
+    if not audio_files:
+        raise SystemExit(" No .wav or .sph file found")
+
+    failed = process_corpus(audio_files, args.output, args.version, args.recover, args.workers, args.torch_threads,
+                            args.cache_dir, args.cache_max_mb, args.files_per_batch, args.output_format, args.frame_rate,
+                            args.build_dir, args.wav_dir, args.backend, args.inter_op_threads)
+    print(f" {len(audio_files) - len(failed)}/{len(audio_files)} files processed, results are stored in {args.output}")
+    raise SystemExit(1 if failed else 0)
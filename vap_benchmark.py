@@ -0,0 +1,280 @@
+import os
+import json
+import wave
+import shutil
+import timeit
+import platform
+import argparse
+import tempfile
+import numpy as np
+import multiprocessing
+from vap_instrument import peak_rss_mb
+
+SAMPLING_RATE = 16000
+STAGES = ("vad", "vad_data_format", "windowing", "mono_to_stereo", "extract_timestamps", "find_speech_overlaps", "flatten_pitch")
+DEFAULT_SIZES = (60, 600, 3600, 10800)  # 1 minute to 3 hours
+MIN_TIMING_SECONDS = 0.5  # A timing loops over a stage until it lasts at least this long (as timeit does)
+
+
+def synthetic_intervals(duration_seconds, seed, n_speakers=2, mean_speech=1.5, mean_silence=1.2):
+    """
+    Known speech intervals of each speaker: alternating exponential speech and silence durations, rounded
+    to 0.1 s like the timestamps of get_speech_timestamps.
+
+    Returns:
+        list: [(start, end), ...] of each speaker, in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    speakers = []
+    for _ in range(n_speakers):
+        intervals = []
+        t = rng.exponential(mean_silence)
+        while True:
+            start = round(t, 1)
+            t += 0.2 + rng.exponential(mean_speech)
+            end = round(min(t, duration_seconds), 1)
+            if start >= duration_seconds or end <= start:
+                break
+            intervals.append((start, end))
+            t += 0.1 + rng.exponential(mean_silence)
+        speakers.append(intervals)
+    return speakers
+
+
+def synthetic_timestamps(duration_seconds, seed):
+    # Silero-style timestamp lists (return_seconds=True) of two speakers
+    return [[{"start": start, "end": end} for start, end in intervals] for intervals in synthetic_intervals(duration_seconds, seed)]
+
+
+def _voice(n_frames, rng, f0):
+    # Harmonic tone with a slow vibrato (voiced, with a pitch for flatten_pitch) plus a little noise
+    t = np.arange(n_frames) / SAMPLING_RATE
+    phase = 2 * np.pi * np.cumsum(f0 + 0.1 * f0 * np.sin(2 * np.pi * 3 * t)) / SAMPLING_RATE
+    tone = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.minimum(1.0, np.minimum(np.arange(n_frames), np.arange(n_frames)[::-1]) / (0.02 * SAMPLING_RATE))
+    return 0.25 * tone * envelope + 0.01 * rng.standard_normal(n_frames)
+
+
+def synthetic_wav(wav_path, duration_seconds, seed, n_channels=2, block_seconds=60):
+    """
+    Write a 16kHz int16 .wav file with the synthetic_intervals of each channel voiced (tones over a noise
+    floor), block by block so that hours of audio never sit in memory.
+
+    Returns:
+        list: The speech intervals of each channel.
+    """
+    speakers = synthetic_intervals(duration_seconds, seed, n_speakers=n_channels)
+    rng = np.random.default_rng(seed + 1)
+    n_total = int(duration_seconds * SAMPLING_RATE)
+    block_frames = int(block_seconds * SAMPLING_RATE)
+    with wave.open(wav_path, "wb") as wav:
+        wav.setnchannels(n_channels)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLING_RATE)
+        for block_start in range(0, n_total, block_frames):
+            block_end = min(n_total, block_start + block_frames)
+            block = 0.003 * rng.standard_normal((block_end - block_start, n_channels))
+            for channel, intervals in enumerate(speakers):
+                f0 = 110 + 90 * channel
+                for start, end in intervals:
+                    start_frame, end_frame = max(block_start, int(start * SAMPLING_RATE)), min(block_end, int(end * SAMPLING_RATE))
+                    if start_frame < end_frame:
+                        block[start_frame - block_start:end_frame - block_start, channel] += _voice(end_frame - start_frame, rng, f0)
+            wav.writeframes((np.clip(block, -1, 1) * 32767).astype("<i2").tobytes())
+    return speakers
+
+
+def synthetic_cha(cha_path, duration_seconds, seed, speakers=("CHI", "MOT", "FAT")):
+    """
+    Write a CHAT transcript with timed utterances of several speakers over duration_seconds, with dependent
+    tiers and some utterances spanning several lines.
+
+    Returns:
+        int: Number of timed utterances.
+    """
+    rng = np.random.default_rng(seed)
+    speaker_intervals = synthetic_intervals(duration_seconds, seed, n_speakers=len(speakers))
+    utterances = sorted((start, speaker, end) for speaker, intervals in zip(speakers, speaker_intervals) for start, end in intervals)
+    lines = ["@UTF8", "@Begin", "@Participants:\t" + ", ".join(f"{speaker} Speaker" for speaker in speakers), "@Media:\tsynthetic, audio"]
+    for start, speaker, end in utterances:
+        bullet = f"\x15{int(start * 1000)}_{int(end * 1000)}\x15"
+        if rng.random() < 0.1:
+            lines += [f"*{speaker}:\tthis is a longer utterance", f"\tover two lines . {bullet}"]
+        else:
+            lines.append(f"*{speaker}:\thello there . {bullet}")
+        if rng.random() < 0.3:
+            lines.append("%mor:\tco|hello adv|there .")
+    lines.append("@End")
+    with open(cha_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return len(utterances)
+
+
+def _prepare(stage, size, work_dir, seed):
+    # Input files of a stage (shared by the stages that need the same input)
+    if stage in ("vad", "flatten_pitch"):
+        path = os.path.join(work_dir, f"stereo_{size}_{seed}.wav")
+        if not os.path.exists(path):
+            synthetic_wav(path, size, seed)
+        return {"audio": path}
+    if stage == "mono_to_stereo":
+        audio = os.path.join(work_dir, f"mono_{size}_{seed}.wav")
+        transcript = os.path.join(work_dir, f"transcript_{size}_{seed}.cha")
+        if not os.path.exists(audio):
+            synthetic_wav(audio, size, seed, n_channels=1)
+        if not os.path.exists(transcript):
+            synthetic_cha(transcript, size, seed)
+        return {"audio": audio, "transcript": transcript, "output": os.path.join(work_dir, f"stereo_out_{size}_{seed}.wav")}
+    if stage in ("extract_timestamps", "find_speech_overlaps"):
+        transcript = os.path.join(work_dir, f"transcript_{size}_{seed}.cha")
+        if not os.path.exists(transcript):
+            synthetic_cha(transcript, size, seed)
+        return {"transcript": transcript}
+    return {}
+
+
+def _stage_runner(stage, size, inputs, seed):
+    # Load what a stage needs (not timed) and return the function to time
+    if stage == "vad":
+        from vad_backend import load_vad_model
+        from vad_inference import stereo_speech_timestamps
+        from vap_gen_data_v3 import VAD_PARAMS
+        model = load_vad_model("jit")
+        return lambda: stereo_speech_timestamps([inputs["audio"]], model, **VAD_PARAMS)
+    # The windowing stages only import vad_windowing: the scripts import torch, whose memory is not theirs
+    if stage == "vad_data_format":
+        from vad_windowing import vad_data_format
+        speaker1, speaker2 = synthetic_timestamps(size, seed)
+        return lambda: [vad_data_format(speaker1, speaker2, start) for start in range(0, int(size) - 19, 20)]
+    if stage == "windowing":
+        from vad_windowing import vad_windows
+        speaker1, speaker2 = synthetic_timestamps(size, seed)
+        # What csv_rows of vap_gen_data_v3.py runs
+        return lambda: list(vad_windows(speaker1, speaker2, size, mode="v3"))
+    if stage == "mono_to_stereo":
+        from mono_to_stereo import mono_to_stereo, extract_timestamps
+        timestamps = extract_timestamps(inputs["transcript"])
+        return lambda: mono_to_stereo(inputs["audio"], timestamps, inputs["output"])
+    if stage == "extract_timestamps":
+        from mono_to_stereo import extract_timestamps
+        return lambda: extract_timestamps(inputs["transcript"])
+    if stage == "find_speech_overlaps":
+        from mono_to_stereo import extract_timestamps, find_speech_overlaps
+        timestamps = extract_timestamps(inputs["transcript"])
+        return lambda: find_speech_overlaps(timestamps)
+    if stage == "flatten_pitch":
+        from Pitch_Flattening import flatten_pitch
+        output = inputs["audio"][:-len(".wav")] + "_flat.wav"
+        return lambda: flatten_pitch(inputs["audio"], output, "mean")
+    raise ValueError(f"Unknown stage {stage!r}, expected one of {STAGES}")
+
+
+def _time_stage(run, repeats, min_seconds=MIN_TIMING_SECONDS):
+    # Best time of one run over repeats timings, each one looping over the run until it lasts min_seconds
+    # (the first loop sizes the others, like timeit's autorange, and counts as the first timing)
+    timer = timeit.Timer(run)
+    number = 1
+    while True:
+        total = timer.timeit(number)
+        if total >= min_seconds:
+            break
+        number *= 10 if total < min_seconds / 10 else 2
+    timings = [total / number] + [timer.timeit(number) / number for _ in range(repeats - 1)]
+    return min(timings), number
+
+
+def _run_stage(stage, size, inputs, seed, repeats, results):
+    # Runs in a fresh process, so the peak memory is the one of this stage only
+    run = _stage_runner(stage, size, inputs, seed)
+    baseline_mb = peak_rss_mb()
+    wall_seconds, number = _time_stage(run, repeats)
+    results.put({"wall_seconds": wall_seconds, "loops": number, "peak_rss_mb": peak_rss_mb(), "peak_delta_mb": peak_rss_mb() - baseline_mb})
+
+
+def benchmark(stages=STAGES, sizes=DEFAULT_SIZES, repeats=5, seed=0, work_dir=None):
+    """
+    Time each stage on deterministic synthetic inputs of each size (in seconds of audio).
+
+    Every measure runs in a fresh process: wall_seconds is the best time of one run over repeats timings (each
+    looping over the stage for at least MIN_TIMING_SECONDS, so sub-millisecond stages are measured reliably),
+    peak_rss_mb the peak resident memory of that process and peak_delta_mb its growth during the stage (after
+    loading the inputs and the modules).
+
+    Returns:
+        list: One dict per (stage, size) with the measures and the throughput (audio seconds per wall second).
+    """
+    keep_inputs = work_dir is not None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="vap_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    records = []
+    try:
+        for stage in stages:
+            for size in sizes:
+                inputs = _prepare(stage, size, work_dir, seed)
+                results = context.Queue()
+                process = context.Process(target=_run_stage, args=(stage, size, inputs, seed, repeats, results))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    print(f" ERROR: {stage} ({size} s) exited with code {process.exitcode}")
+                    continue
+                record = {"stage": stage, "size_seconds": size, **results.get()}
+                record["throughput"] = size / record["wall_seconds"] if record["wall_seconds"] > 0 else float("inf")
+                records.append(record)
+                print(f" {stage:21} {size:6} s: {record['wall_seconds']:9.3f} s, {record['throughput']:10.1f} audio s/s, "
+                      f"peak {record['peak_rss_mb']:7.1f} MB (+{record['peak_delta_mb']:.1f})")
+    finally:
+        if not keep_inputs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return records
+
+
+def compare(records, baseline_records, tolerance=0.2):
+    """
+    Compare the throughput and the memory growth (peak_delta_mb, which does not count the memory of the imported
+    modules) of each (stage, size) with a baseline run.
+
+    Returns:
+        list: (stage, size, throughput ratio) of the measures slower than the baseline by more than tolerance.
+    """
+    baseline = {(record["stage"], record["size_seconds"]): record for record in baseline_records}
+    regressions = []
+    for record in records:
+        reference = baseline.get((record["stage"], record["size_seconds"]))
+        if reference is None:
+            continue
+        ratio = record["throughput"] / reference["throughput"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append((record["stage"], record["size_seconds"], ratio))
+            flag = "  REGRESSION"
+        print(f" {record['stage']:21} {record['size_seconds']:6} s: x{ratio:.2f} throughput, "
+              f"{record['peak_delta_mb'] - reference['peak_delta_mb']:+.1f} MB peak growth{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic stereo audio and transcripts")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES), help="Input sizes in seconds of audio")
+    parser.add_argument("--repeats", type=int, default=5, help="Timings per measure, each of at least 0.5 s (the best is kept)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work_dir", type=str, default=None, help="Keep the synthetic inputs there (default: temporary directory)")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Machine-readable results")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Throughput loss reported as a regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    records = benchmark(args.stages, args.sizes, args.repeats, args.seed, args.work_dir)
+    machine = {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+               "cpu_count": os.cpu_count()}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"machine": machine, "seed": args.seed, "repeats": args.repeats, "results": records}, f, indent=1)
+    print(f" Results are stored in {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(records, baseline["results"], args.tolerance)
+        raise SystemExit(1 if regressions else 0)
@@ -1,31 +1,47 @@
-from silero_vad import load_silero_vad, read_audio, get_speech_timestamps
 import argparse
-import io
-from pydub import AudioSegment
 import csv
+from vad_backend import BACKENDS, DEFAULT_INTER_OP_THREADS, DEFAULT_INTRA_OP_THREADS, backend_info, load_vad_model, write_backend_info
+from vad_inference import stereo_speech_timestamps
+from vad_streaming import stream_windows
+from vad_windowing import vad_windows
+from vap_instrument import add_audio_seconds, add_instrumentation_arguments, enable_instrumentation, stage, track_file
 
 
-def vad_data_format(speaker1, speaker2, startAudioSegment):
-    # Convert silero_vad output into VAD data format for VAP-Realtime training (https://github.com/inokoj/VAP-Realtime/tree/main/train)
+# Silero VAD parameters (also part of the vad_cache key)
+VAD_PARAMS = {"threshold": 0.5, "min_speech_duration_ms": 50, "min_silence_duration_ms": 50, "speech_pad_ms": 10}
 
-    speaker1_segment_speech = []
-    speaker2_segment_speech = []
-    speech_id_speaker1 = 0
-    speech_id_speaker2 = 0
+CSV_HEADER = ["audio_path", "start", "end", "vad_list", "session", "dataset"]
 
-    while(speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['start']<startAudioSegment):
-        speech_id_speaker1+=1
-    while(speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['end']<startAudioSegment+20+2): # 2 seconds window for future voice activity
-        speaker1_segment_speech.append([speaker1[speech_id_speaker1]['start']-startAudioSegment, speaker1[speech_id_speaker1]['end']-startAudioSegment])
-        speech_id_speaker1+=1
 
-    while(speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['start']<startAudioSegment):
-        speech_id_speaker2+=1
-    while(speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['end']<startAudioSegment+20+2): # 2 seconds window for future voice activity
-        speaker2_segment_speech.append([speaker2[speech_id_speaker2]['start']-startAudioSegment, speaker2[speech_id_speaker2]['end']-startAudioSegment])
-        speech_id_speaker2+=1
+def speech_timestamps(audio_file, model):
+    # Run silero_vad on both channels of a stereo audio file, return (duration in seconds, speaker1 timestamps, speaker2 timestamps)
+    # The samples are read once (memory-mapped for .wav), both channels go through the model one after another on jit
+    # and as a batch of 2 on onnx (see vad_inference.JIT_MIN_BATCH)
+    return stereo_speech_timestamps([audio_file], model, **VAD_PARAMS)[0]
+
+
+def csv_rows(audio_file, duration_seconds, speech_timestamps_first_speaker, speech_timestamps_second_speaker, recover=0):
+    # Build the .csv rows (without header) of one audio file (see vad_windowing for the windowing)
+    csv_data = []
+
+    for startAudioSegment, endAudioSegment, vad_list in vad_windows(speech_timestamps_first_speaker, speech_timestamps_second_speaker, duration_seconds, mode="v2", recover=recover):
+        csv_data_line = [
+            audio_file, 
+            startAudioSegment, 
+            endAudioSegment, 
+            vad_list,
+            0, # Arbitrary
+            "sample", # Arbitrary
+            ]
+        csv_data.append(csv_data_line)
+    return csv_data
+
+
+def stream_csv_rows(audio_file, model, recover=0):
+    # Same rows as csv_rows, computed block by block with a bounded memory (see vad_streaming)
+    for start_time, end_time, vad_list in stream_windows(audio_file, model, mode="v2", recover=recover, **VAD_PARAMS):
+        yield [audio_file, start_time, end_time, vad_list, 0, "sample"]
 
-    return [speaker1_segment_speech, speaker2_segment_speech]
 
 if __name__ == "__main__":
 
@@ -34,54 +50,39 @@ if __name__ == "__main__":
     parser.add_argument("--path_audio_file", type=str, default='')
     parser.add_argument("--output_csv", type=str, default='output.csv')
     parser.add_argument("--recover", type=int, default=0, help="An integer between 0 and 19.")
+    parser.add_argument("--streaming", action="store_true", help="Read the audio block by block (constant memory, 16kHz .wav only)")
+    parser.add_argument("--backend", choices=BACKENDS, default="jit", help="VAD inference backend (torch JIT or ONNX Runtime)")
+    parser.add_argument("--intra_op_threads", type=int, default=DEFAULT_INTRA_OP_THREADS, help="CPU threads inside one operator (1 suits several scripts running side by side)")
+    parser.add_argument("--inter_op_threads", type=int, default=DEFAULT_INTER_OP_THREADS, help="CPU threads running operators in parallel")
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
+    enable_instrumentation(args.instrument, args.profile_dir)
 
     if not 0 <= args.recover <= 19:
         raise argparse.ArgumentTypeError(f"{args.recover} is not between 0 and 19")
     
-    # Load the audio file
     audio_file = args.path_audio_file
-    sound = AudioSegment.from_file(audio_file)
-
-    # Split the stereo audio into two mono channels
-    first_speaker = sound.split_to_mono()[0]
-    second_speaker = sound.split_to_mono()[1]
-
-    # Stream the two channels separately (to avoid creating files)
-    first_speaker_buffer = io.BytesIO()
-    second_speaker_buffer = io.BytesIO()
-    first_speaker.export(first_speaker_buffer, format="wav")
-    second_speaker.export(second_speaker_buffer, format="wav")
-    first_speaker_buffer.seek(0)
-    second_speaker_buffer.seek(0)
-
-    # Import model and read both channels
-    model = load_silero_vad()
-    first_speaker_audio = read_audio(first_speaker_buffer, sampling_rate=16000)
-    second_speaker_audio = read_audio(second_speaker_buffer, sampling_rate=16000)
-
-    speech_timestamps_first_speaker = get_speech_timestamps(first_speaker_audio, model, min_speech_duration_ms = 50, min_silence_duration_ms= 50, speech_pad_ms = 10, return_seconds=True)
-    speech_timestamps_second_speaker = get_speech_timestamps(second_speaker_audio, model, min_speech_duration_ms = 50, min_silence_duration_ms= 50, speech_pad_ms = 10, return_seconds=True)
-
-    # Create the .csv file (input for the model training)
-    csv_data = [
-        ["audio_path", "start", "end", "vad_list", "session", "dataset"]
-    ]
-
-    shift = args.recover
-    startAudioSegment = 0
-    while startAudioSegment < sound.duration_seconds:
-        csv_data_line = [
-            audio_file, 
-            startAudioSegment, 
-            startAudioSegment+20, 
-            vad_data_format(speech_timestamps_first_speaker, speech_timestamps_second_speaker, startAudioSegment),
-            0, # Arbitrary
-            "sample", # Arbitrary
-            ]
-        csv_data.append(csv_data_line)
-        startAudioSegment += 20 - shift
-        
-    with open(args.output_csv, "w", newline="", encoding="utf-8") as csvfile:
+    with stage("load_model"):
+        model = load_vad_model(args.backend, args.intra_op_threads, args.inter_op_threads)
+    # The backend is recorded next to the CSV file
+    write_backend_info(args.output_csv, backend_info(args.backend, args.intra_op_threads, args.inter_op_threads))
+
+    with track_file(audio_file), open(args.output_csv, "w", newline="", encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerows(csv_data) 
\ No newline at end of file
+        if args.streaming:
+            # Rows are written as soon as their segment is complete
+            writer.writerow(CSV_HEADER)
+            # Decoding, VAD and windowing are measured by stream_windows, between the rows
+            for row in stream_csv_rows(audio_file, model, args.recover):
+                with stage("write"):
+                    writer.writerow(row)
+        else:
+            # Compute the timestamps of both channels
+            duration_seconds, speech_timestamps_first_speaker, speech_timestamps_second_speaker = speech_timestamps(audio_file, model)
+            add_audio_seconds(duration_seconds)
+
+            # Create the .csv file (input for the model training)
+            with stage("windowing"):
+                csv_data = [CSV_HEADER] + csv_rows(audio_file, duration_seconds, speech_timestamps_first_speaker, speech_timestamps_second_speaker, args.recover)
+            with stage("write"):
+                writer.writerows(csv_data) 
\ No newline at end of file
@@ -1,46 +1,57 @@
-from silero_vad import load_silero_vad, read_audio, get_speech_timestamps
 import argparse
-import io
-from pydub import AudioSegment
 import csv
+from vad_backend import BACKENDS, DEFAULT_INTER_OP_THREADS, DEFAULT_INTRA_OP_THREADS, backend_info, load_vad_model, write_backend_info
+from vad_inference import stereo_speech_timestamps
+from vad_streaming import stream_windows
+from vad_windowing import vad_data_format, vad_windows  # vad_data_format: reference implementation, kept importable from here
+from vap_instrument import add_audio_seconds, add_instrumentation_arguments, enable_instrumentation, stage, track_file
 
 
-def vad_data_format(speaker1, speaker2, startAudioSegment):
-    """
-    Convert Silero VAD output into VAD data format for VAP-Realtime training.
-    Ensures proper segment inclusion and prevents missing short segments.
-    """
+# Silero VAD parameters (also part of the vad_cache key)
+VAD_PARAMS = {"threshold": 0.5, "min_speech_duration_ms": 50, "min_silence_duration_ms": 50, "speech_pad_ms": 10}
 
-    speaker1_segment_speech = []
-    speaker2_segment_speech = []
-    speech_id_speaker1 = 0
-    speech_id_speaker2 = 0
+CSV_HEADER = ["audio_path", "start", "end", "vad_list", "session", "dataset"]
 
-    # Ensure all valid speech segments are included
-    while speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['end'] <= startAudioSegment:
-        speech_id_speaker1 += 1
 
-    while speech_id_speaker1 < len(speaker1) and speaker1[speech_id_speaker1]['start'] < startAudioSegment + 20:
-        start_time = max(0, speaker1[speech_id_speaker1]['start'] - startAudioSegment)
-        end_time = min(20, speaker1[speech_id_speaker1]['end'] - startAudioSegment)
+def speech_timestamps(audio_file, model):
+    """
+    Run Silero VAD on both channels of a stereo audio file.
+    Returns (duration in seconds, speaker1 timestamps, speaker2 timestamps).
+    """
+    # Read the samples once (memory-mapped for .wav), both channels go through the model one after another on jit
+    # and as a batch of 2 on onnx (see vad_inference.JIT_MIN_BATCH)
+    return stereo_speech_timestamps([audio_file], model, **VAD_PARAMS)[0]
 
-        # Ensure very short segments are not ignored
-        if end_time > start_time or (end_time - start_time) >= 0.05:
-            speaker1_segment_speech.append([round(start_time, 6), round(end_time, 6)])
-        speech_id_speaker1 += 1
 
-    while speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['end'] <= startAudioSegment:
-        speech_id_speaker2 += 1
+def csv_rows(audio_file, duration_seconds, speech_timestamps_first_speaker, speech_timestamps_second_speaker, recover=0):
+    """
+    Build the CSV rows (without header) of one audio file.
+    All segments are computed in one pass over the timestamps (see vad_windowing).
+    """
+    csv_data = []
 
-    while speech_id_speaker2 < len(speaker2) and speaker2[speech_id_speaker2]['start'] < startAudioSegment + 20:
-        start_time = max(0, speaker2[speech_id_speaker2]['start'] - startAudioSegment)
-        end_time = min(20, speaker2[speech_id_speaker2]['end'] - startAudioSegment)
+    for startAudioSegment, endAudioSegment, vad_list in vad_windows(
+        speech_timestamps_first_speaker, speech_timestamps_second_speaker, duration_seconds, mode="v3", recover=recover
+    ):
+        csv_data_line = [
+            audio_file,
+            startAudioSegment,
+            endAudioSegment,
+            vad_list,
+            0,  # Arbitrary
+            "sample",  # Arbitrary
+        ]
+        csv_data.append(csv_data_line)
 
-        if end_time > start_time or (end_time - start_time) >= 0.05:
-            speaker2_segment_speech.append([round(start_time, 6), round(end_time, 6)])
-        speech_id_speaker2 += 1
+    return csv_data
 
-    return [speaker1_segment_speech, speaker2_segment_speech]
+
+def stream_csv_rows(audio_file, model, recover=0):
+    """
+    Same rows as csv_rows, computed block by block with a bounded memory (see vad_streaming).
+    """
+    for startAudioSegment, endAudioSegment, vad_list in stream_windows(audio_file, model, mode="v3", recover=recover, **VAD_PARAMS):
+        yield [audio_file, startAudioSegment, endAudioSegment, vad_list, 0, "sample"]
 
 
 if __name__ == "__main__":
@@ -50,59 +61,41 @@ if __name__ == "__main__":
     parser.add_argument("--path_audio_file", type=str, required=True, help="Path to the input audio file")
     parser.add_argument("--output_csv", type=str, default='output.csv', help="Output CSV file name")
     parser.add_argument("--recover", type=int, default=0, help="An integer between 0 and 19.")
+    parser.add_argument("--streaming", action="store_true", help="Read the audio block by block (constant memory, 16kHz .wav only)")
+    parser.add_argument("--backend", choices=BACKENDS, default="jit", help="VAD inference backend (torch JIT or ONNX Runtime)")
+    parser.add_argument("--intra_op_threads", type=int, default=DEFAULT_INTRA_OP_THREADS, help="CPU threads inside one operator (1 suits several scripts running side by side)")
+    parser.add_argument("--inter_op_threads", type=int, default=DEFAULT_INTER_OP_THREADS, help="CPU threads running operators in parallel")
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
+    enable_instrumentation(args.instrument, args.profile_dir)
 
     if not 0 <= args.recover <= 19:
         raise argparse.ArgumentTypeError(f"{args.recover} is not between 0 and 19")
     
-    # Load the audio file
+    # Load Silero VAD model
     audio_file = args.path_audio_file
-    sound = AudioSegment.from_file(audio_file)
-
-    # Split stereo audio into two mono channels
-    first_speaker, second_speaker = sound.split_to_mono()
-
-    # Stream the two channels separately (to avoid creating files)
-    first_speaker_buffer = io.BytesIO()
-    second_speaker_buffer = io.BytesIO()
-    first_speaker.export(first_speaker_buffer, format="wav")
-    second_speaker.export(second_speaker_buffer, format="wav")
-    first_speaker_buffer.seek(0)
-    second_speaker_buffer.seek(0)
-
-    # Load Silero VAD model and process both channels
-    model = load_silero_vad()
-    first_speaker_audio = read_audio(first_speaker_buffer, sampling_rate=16000)
-    second_speaker_audio = read_audio(second_speaker_buffer, sampling_rate=16000)
-
-    speech_timestamps_first_speaker = get_speech_timestamps(
-        first_speaker_audio, model, min_speech_duration_ms=50, min_silence_duration_ms=50, speech_pad_ms=10, return_seconds=True
-    )
-    
-    speech_timestamps_second_speaker = get_speech_timestamps(
-        second_speaker_audio, model, min_speech_duration_ms=50, min_silence_duration_ms=50, speech_pad_ms=10, return_seconds=True
-    )
-
-    # Create CSV file (input for model training)
-    csv_data = [["audio_path", "start", "end", "vad_list", "session", "dataset"]]
-
-    shift = args.recover
-    startAudioSegment = 0
-
-    # Ensure no extra segment is added at the end
-    while startAudioSegment + 20 <= sound.duration_seconds:
-        csv_data_line = [
-            audio_file,
-            startAudioSegment,
-            startAudioSegment + 20,
-            vad_data_format(speech_timestamps_first_speaker, speech_timestamps_second_speaker, startAudioSegment),
-            0,  # Arbitrary
-            "sample",  # Arbitrary
-        ]
-        csv_data.append(csv_data_line)
-        startAudioSegment += 20 - shift
+    with stage("load_model"):
+        model = load_vad_model(args.backend, args.intra_op_threads, args.inter_op_threads)
+    # The backend is recorded next to the CSV file
+    write_backend_info(args.output_csv, backend_info(args.backend, args.intra_op_threads, args.inter_op_threads))
 
     # Save results to CSV
-    with open(args.output_csv, "w", newline="", encoding="utf-8") as csvfile:
+    with track_file(audio_file), open(args.output_csv, "w", newline="", encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerows(csv_data)
+        if args.streaming:
+            # Rows are written as soon as their segment is complete
+            writer.writerow(CSV_HEADER)
+            # Decoding, VAD and windowing are measured by stream_windows, between the rows
+            for row in stream_csv_rows(audio_file, model, args.recover):
+                with stage("write"):
+                    writer.writerow(row)
+        else:
+            # Process both channels
+            duration_seconds, speech_timestamps_first_speaker, speech_timestamps_second_speaker = speech_timestamps(audio_file, model)
+            add_audio_seconds(duration_seconds)
+
+            # Create CSV file (input for model training)
+            with stage("windowing"):
+                csv_data = [CSV_HEADER] + csv_rows(audio_file, duration_seconds, speech_timestamps_first_speaker, speech_timestamps_second_speaker, args.recover)
+            with stage("write"):
+                writer.writerows(csv_data)
\ No newline at end of file
@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import resource
+
+# Instrumentation is configured through the environment, so the worker processes of vap_batch.py,
+# mono_to_stereo.py and Pitch_Flattening.py (and the scripts run by process_all_wav_files.sh) inherit it
+ENV_OUTPUT = "VAP_INSTRUMENT"  # JSON-lines file receiving one record per file
+ENV_PROFILE_DIR = "VAP_PROFILE_DIR"  # When set, a cProfile dump per file is written there
+
+
+class _NullContext:
+    # What stage and track_file return when the instrumentation is off: nothing is measured
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+def peak_rss_mb():
+    # Peak resident memory of the process so far (ru_maxrss is in kB on Linux, in bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class _Span:
+    # Wall time, CPU time and peak RSS growth of a block of code
+    def __enter__(self):
+        self.start_peak = peak_rss_mb()
+        self.start_cpu = time.process_time()
+        self.start_wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_seconds = time.perf_counter() - self.start_wall
+        self.cpu_seconds = time.process_time() - self.start_cpu
+        self.peak_rss_mb = peak_rss_mb()
+        return False
+
+
+class _Stage(_Span):
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        self.recorder.add_stage(self.name, self)
+        return False
+
+
+class _FileRecord(_Span):
+    def __init__(self, recorder, path, audio_seconds, fields):
+        self.recorder = recorder
+        self.record = {"file": path, "audio_seconds": audio_seconds, **fields}
+        self.stages = {}
+        self.profiler = None
+        self.untracked_wall = 0.0  # Time spent in untracked() blocks, not charged to the file
+        self.untracked_cpu = 0.0
+
+    def __enter__(self):
+        self.parent = self.recorder.current
+        self.recorder.current = self
+        if self.recorder.profile_dir is not None:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        self.wall_seconds -= self.untracked_wall
+        self.cpu_seconds -= self.untracked_cpu
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.recorder.profile_path(self.record["file"]))
+        self.recorder.current = self.parent
+        self.recorder.write_unattached()
+        audio_seconds = self.record["audio_seconds"]
+        self.record.update({
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_mb": self.peak_rss_mb,
+            # Processing time per second of audio: below 1 is faster than real time
+            "realtime_factor": self.wall_seconds / audio_seconds if audio_seconds else None,
+            "stages": self.stages,
+        })
+        if exc_type is not None:
+            self.record["error"] = f"{exc_type.__name__}: {exc}"
+        self.recorder.write(self.record)
+        return False
+
+
+class _Untracked(_Span):
+    # Detaches the current file records for the duration of the block
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def __enter__(self):
+        self.record = self.recorder.current
+        self.recorder.current = None
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        self.recorder.current = self.record
+        record = self.record
+        while record is not None:
+            record.untracked_wall += self.wall_seconds
+            record.untracked_cpu += self.cpu_seconds
+            record = record.parent
+        return False
+
+
+class Recorder:
+    """
+    Writes one JSON line per tracked file (or per batch of files) to output:
+
+        file, audio_seconds, wall_seconds, cpu_seconds, peak_rss_mb, realtime_factor, error (if any), pid, entry,
+        stages: {name: {calls, wall_seconds, cpu_seconds, peak_rss_mb, rss_growth_mb}}
+
+    peak_rss_mb is the peak resident memory of the process at the end of the stage (or file), rss_growth_mb how
+    much the stage raised it. Stages run outside of any tracked file, or in an untracked() block (e.g. the model
+    loading, or the writing of the rows by the parent of vap_batch.py), add up in one record whose file is null,
+    written before the next file record of the process and at its exit.
+
+    Parameters:
+        output (str): JSON-lines file, appended to (several processes can share it).
+        profile_dir (str): When set, each tracked file is also profiled with cProfile, the dump is written there
+            as <file name>.<pid>.prof (read it with pstats or snakeviz). Sampling profilers need no hook, e.g.
+            py-spy record --subprocesses -- python vap_batch.py ...
+    """
+
+    def __init__(self, output, profile_dir=None):
+        self.output = output
+        self.profile_dir = profile_dir
+        self.current = None
+        self.unattached = {}  # Stages run outside of any tracked file, not written yet
+        self.entry = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        atexit.register(self.write_unattached)
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def track_file(self, path, audio_seconds=None, **fields):
+        return _FileRecord(self, path, audio_seconds, fields)
+
+    def untracked(self):
+        return _Untracked(self)
+
+    def add_stage(self, name, span):
+        stage = {"calls": 1, "wall_seconds": span.wall_seconds, "cpu_seconds": span.cpu_seconds,
+                 "peak_rss_mb": span.peak_rss_mb, "rss_growth_mb": span.peak_rss_mb - span.start_peak}
+        stages = self.unattached if self.current is None else self.current.stages
+        if name in stages:
+            # A stage run several times for the same file (e.g. decode of each file of a batch) adds up
+            total = stages[name]
+            total["calls"] += 1
+            total["wall_seconds"] += stage["wall_seconds"]
+            total["cpu_seconds"] += stage["cpu_seconds"]
+            total["rss_growth_mb"] += stage["rss_growth_mb"]
+            total["peak_rss_mb"] = stage["peak_rss_mb"]
+        else:
+            stages[name] = stage
+
+    def write_unattached(self):
+        if self.unattached:
+            self.write({"file": None, "stages": self.unattached})
+            self.unattached = {}
+
+    def add_audio_seconds(self, seconds):
+        if self.current is not None:
+            self.current.record["audio_seconds"] = (self.current.record["audio_seconds"] or 0) + seconds
+
+    def profile_path(self, path):
+        name = os.path.basename(path[0] if isinstance(path, list) else str(path))
+        return os.path.join(self.profile_dir, f"{name}.{os.getpid()}.prof")
+
+    def write(self, record):
+        record = dict(record, pid=os.getpid(), entry=self.entry)
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        # One write of the whole line on a file opened in append mode, so the lines of several processes never mix
+        fd = os.open(self.output, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+def _recorder_from_env():
+    output = os.environ.get(ENV_OUTPUT)
+    return Recorder(output, os.environ.get(ENV_PROFILE_DIR)) if output else None
+
+
+_recorder = _recorder_from_env()
+
+
+def enable_instrumentation(output, profile_dir=None):
+    """
+    Record the stages of this process and of the worker processes it starts afterwards to output
+    (see Recorder). Does nothing when output is None, so it can be given the value of a command line option.
+    """
+    global _recorder
+    if output is None:
+        return
+    os.environ[ENV_OUTPUT] = output
+    if profile_dir is not None:
+        os.environ[ENV_PROFILE_DIR] = profile_dir
+    _recorder = Recorder(output, profile_dir)
+
+
+def stage(name):
+    """
+    Context manager measuring one stage (decode, vad, windowing, write, ...) of the current file.
+    When the instrumentation is off it returns a shared object whose __enter__/__exit__ do nothing.
+    """
+    return _NULL if _recorder is None else _recorder.stage(name)
+
+
+def track_file(path, audio_seconds=None, **fields):
+    # Context manager around the processing of one file (or list of files processed together), writing its record
+    return _NULL if _recorder is None else _recorder.track_file(path, audio_seconds, **fields)
+
+
+def untracked():
+    """
+    Context manager whose stages and time are not charged to the current file: its stages go to the record
+    without file (e.g. a model loaded while processing the first file that needs it).
+    """
+    return _NULL if _recorder is None else _recorder.untracked()
+
+
+def add_audio_seconds(seconds):
+    # Add to the audio duration of the current file, for when it is only known once the audio is decoded
+    if _recorder is not None:
+        _recorder.add_audio_seconds(seconds)
+
+
+def add_instrumentation_arguments(parser):
+    # --instrument and --profile_dir options shared by the entry points
+    parser.add_argument("--instrument", type=str, default=os.environ.get(ENV_OUTPUT),
+                        help=f"Append per-file stage timings to this JSON-lines file (default: ${ENV_OUTPUT}, off if unset)")
+    parser.add_argument("--profile_dir", type=str, default=os.environ.get(ENV_PROFILE_DIR),
+                        help="With --instrument, also write a cProfile dump of each file there")
+
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records):
+    """
+    Totals of each stage over records read from a JSON-lines file.
+
+    Returns:
+        dict: Number of file records (one per channel for the parallel Pitch_Flattening.py), their total audio,
+            wall and CPU seconds, and per stage {calls, wall_seconds,
+            cpu_seconds, max_peak_rss_mb}.
+    """
+    summary = {"records": 0, "audio_seconds": 0.0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "stages": {}}
+    for record in records:
+        if record["file"] is not None:
+            summary["records"] += 1
+            summary["audio_seconds"] += record["audio_seconds"] or 0
+            summary["wall_seconds"] += record["wall_seconds"]
+            summary["cpu_seconds"] += record["cpu_seconds"]
+        for name, stage_record in record["stages"].items():
+            total = summary["stages"].setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "max_peak_rss_mb": 0.0})
+            total["calls"] += stage_record["calls"]
+            total["wall_seconds"] += stage_record["wall_seconds"]
+            total["cpu_seconds"] += stage_record["cpu_seconds"]
+            total["max_peak_rss_mb"] = max(total["max_peak_rss_mb"], stage_record["peak_rss_mb"])
+    return summary
+
+
+def print_summary(summary):
+    # Table of the stages, slowest first
+    print(f" {summary['records']} records, {summary['audio_seconds']:.1f} s of audio in {summary['wall_seconds']:.1f} s "
+          f"(CPU {summary['cpu_seconds']:.1f} s, realtime factor "
+          f"{summary['wall_seconds'] / summary['audio_seconds'] if summary['audio_seconds'] else float('nan'):.4f})")
+    print(f" {'stage':20} {'calls':>7} {'wall s':>10} {'share':>6} {'cpu s':>10} {'peak MB':>9}")
+    stages_wall = sum(stage_record["wall_seconds"] for stage_record in summary["stages"].values()) or 1
+    for name, stage_record in sorted(summary["stages"].items(), key=lambda item: item[1]["wall_seconds"], reverse=True):
+        print(f" {name:20} {stage_record['calls']:7} {stage_record['wall_seconds']:10.2f} "
+              f"{100 * stage_record['wall_seconds'] / stages_wall:5.1f}% {stage_record['cpu_seconds']:10.2f} {stage_record['max_peak_rss_mb']:9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summary table of the stage timings written with --instrument")
+    parser.add_argument("records", nargs="+", help="JSON-lines files written by the instrumented scripts")
+    args = parser.parse_args()
+
+    print_summary(summarize([record for path in args.records for record in read_records(path)]))
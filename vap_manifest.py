@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+from atomic_file import atomic_path
+from vad_cache import audio_hash
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def _atomic_write(path, text):
+    # Readers never see a partial file (see atomic_file)
+    with atomic_path(path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+class BuildManifest:
+    """
+    Record of a corpus build, so an interrupted or repeated build only processes new or changed files.
+
+    The rows of each recording go to their own shard (build_dir/shards/<hash of the path>.json, written
+    atomically) and each finished recording appends one line to build_dir/manifest.jsonl with its path, size,
+    mtime, content hash, build parameters and shard. A recording is done when its last manifest line matches
+    the current file and parameters and its shard exists; merge() then combines the shards in input order.
+
+    Parameters:
+        build_dir (str): Directory of the manifest and shards (created if needed).
+    """
+
+    def __init__(self, build_dir):
+        self.build_dir = build_dir
+        self.shards_dir = os.path.join(build_dir, "shards")
+        self.manifest_path = os.path.join(build_dir, MANIFEST_NAME)
+        os.makedirs(self.shards_dir, exist_ok=True)
+        self.entries = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Line cut by a crash
+                    self.entries[entry["audio_path"]] = entry
+
+    def shard_path(self, audio_file):
+        name = hashlib.sha256(os.path.abspath(audio_file).encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.shards_dir, f"{name}.json")
+
+    def fingerprint(self, audio_file):
+        """
+        Return (size, mtime_ns, content hash) of a file. The file is only hashed when its size is the one of the
+        manifest entry but its mtime changed (touched, maybe unchanged); the hash is None for a new file or a
+        file whose size changed, which has to be processed anyway (the worker hashes it then, see vap_batch).
+        """
+        stat = os.stat(audio_file)
+        entry = self.entries.get(audio_file)
+        if entry is None or entry["size"] != stat.st_size:
+            return stat.st_size, stat.st_mtime_ns, None
+        if entry["mtime_ns"] == stat.st_mtime_ns:
+            return stat.st_size, stat.st_mtime_ns, entry["sha256"]
+        return stat.st_size, stat.st_mtime_ns, audio_hash(audio_file)
+
+    def is_done(self, audio_file, params, fingerprint):
+        # True if the shard of this file is up to date (a touched but unchanged file is not processed again)
+        entry = self.entries.get(audio_file)
+        if entry is None or fingerprint[2] is None or entry["params"] != params or entry["sha256"] != fingerprint[2]:
+            return False
+        return os.path.exists(os.path.join(self.shards_dir, entry["shard"]))
+
+    def record(self, audio_file, params, fingerprint, rows):
+        """
+        Write the shard of a processed file then append its manifest line.
+        """
+        shard_path = self.shard_path(audio_file)
+        _atomic_write(shard_path, json.dumps(rows))
+        size, mtime_ns, sha256 = fingerprint
+        entry = {"audio_path": audio_file, "size": size, "mtime_ns": mtime_ns, "sha256": sha256,
+                 "params": params, "shard": os.path.basename(shard_path), "n_rows": len(rows)}
+        self.entries[audio_file] = entry
+        # One write of one line in append mode: concurrent builds never interleave inside a line
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def read_shard(self, audio_file):
+        with open(os.path.join(self.shards_dir, self.entries[audio_file]["shard"]), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def merge(self, audio_files, writer):
+        """
+        Write the rows of done files, in the order of audio_files, with a vap_output writer.
+
+        Returns:
+            int: Number of rows written.
+        """
+        n_rows = 0
+        for audio_file in audio_files:
+            rows = self.read_shard(audio_file)
+            writer.write_rows(rows)
+            n_rows += len(rows)
+        return n_rows
+
+    def compact(self):
+        # Rewrite the manifest with only the last line of each file, keeping lines appended by another build
+        self.entries.update(BuildManifest(self.build_dir).entries)
+        _atomic_write(self.manifest_path, "".join(json.dumps(entry) + "\n" for entry in self.entries.values()))
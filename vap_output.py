@@ -0,0 +1,237 @@
+import os
+import csv
+import json
+import numpy as np
+from contextlib import ExitStack
+from atomic_file import atomic_path
+
+CSV_HEADER = ["audio_path", "start", "end", "vad_list", "session", "dataset"]
+
+FORMATS = ("csv", "npy", "parquet")
+
+
+def vad_frames(vad_list, frame_rate=50, frame_seconds=22):
+    """
+    Frame-level voice activity of one segment.
+
+    Frame k of a speaker is active if it lies in [start, end) of one of its speeches, i.e.
+    int(start * frame_rate) <= k < int(end * frame_rate).
+
+    Parameters:
+        vad_list (list): [speaker1 speeches, speaker2 speeches] as vad_data_format returns them.
+        frame_rate (int): Frames per second.
+        frame_seconds (float): Duration covered by the frames (20 seconds + 2 seconds of lookahead by default).
+
+    Returns:
+        ndarray: (2, frame_seconds * frame_rate) uint8 array.
+    """
+    n_frames = int(round(frame_seconds * frame_rate))
+    frames = np.zeros((2, n_frames), dtype=np.uint8)
+    for speaker, speeches in enumerate(vad_list):
+        for start, end in speeches:
+            # The small epsilon keeps e.g. 0.29 * 100 = 28.999999999999996 on frame 29
+            start_frame = max(0, int(np.floor(start * frame_rate + 1e-9)))
+            end_frame = min(n_frames, int(np.floor(end * frame_rate + 1e-9)))
+            frames[speaker, start_frame:end_frame] = 1
+    return frames
+
+
+class _AtomicWriter:
+    # The files of a writer are written to temporary files (see atomic_file) and renamed by close(), or removed
+    # when the with block of the writer fails, so a crash never leaves a truncated output
+    def __init__(self):
+        self._stack = ExitStack()
+
+    def _open(self, path, mode, **kwargs):
+        # File opened on a temporary path, closed then renamed to path by close()
+        return self._stack.enter_context(open(self._stack.enter_context(atomic_path(path)), mode, **kwargs))
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        self._finish()
+        self._stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self._stack.__exit__(*exc)
+        return False
+
+
+class CsvWriter(_AtomicWriter):
+    """
+    Rows as written by vap_gen_data*.py: vad_list is the text of a Python list.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._file = self._open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(CSV_HEADER)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+
+class _FrameFile:
+    # Raw (n_windows, 2, n_frames) uint8 activity, appended window by window and memory-mapped by load_npy
+    def __init__(self, writer, path, frame_rate, frame_seconds):
+        self.path = path
+        self.frame_rate = frame_rate
+        self.frame_seconds = frame_seconds
+        self.n_frames = int(round(frame_seconds * frame_rate))
+        self._file = writer._open(path, "wb")
+
+    def write(self, vad_list):
+        self._file.write(vad_frames(vad_list, self.frame_rate, self.frame_seconds).tobytes())
+
+    def meta(self):
+        return {"frames_file": os.path.basename(self.path), "frame_rate": self.frame_rate,
+                "frame_seconds": self.frame_seconds, "n_frames": self.n_frames}
+
+
+class NpyWriter(_AtomicWriter):
+    """
+    Segments as NumPy arrays in a directory, read back without any parsing by load_npy:
+
+        windows.npy     (n_windows,) structured array: audio_id, start, end, session, dataset_id
+        speeches.npy    (n_speeches, 2) float64 start/end of every speech, relative to the segment start
+        offsets.npy     (2 * n_windows + 1,) int64: speeches of speaker s of window w are
+                        speeches[offsets[2 * w + s]:offsets[2 * w + s + 1]]
+        frames.u8       optional (n_windows, 2, n_frames) uint8 frame-level activity (see vad_frames)
+        meta.json       audio paths and dataset names (indexed by audio_id and dataset_id) and frame parameters
+
+    Parameters:
+        output_dir (str): Directory of the arrays (created if needed).
+        frame_rate (int): When set, also write the frame-level activity at this rate.
+        frame_seconds (float): Duration covered by the frames of a segment.
+    """
+
+    WINDOW_DTYPE = np.dtype([("audio_id", np.int32), ("start", np.float64), ("end", np.float64), ("session", np.int64),
+                             ("dataset_id", np.int32)])
+
+    def __init__(self, output_dir, frame_rate=None, frame_seconds=22):
+        super().__init__()
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self._audio_ids = {}
+        self._dataset_ids = {}
+        self._windows = []
+        self._speeches = []
+        self._offsets = [0]
+        self._frames = None if frame_rate is None else _FrameFile(self, os.path.join(output_dir, "frames.u8"), frame_rate, frame_seconds)
+
+    def write_rows(self, rows):
+        for audio_path, start, end, vad_list, session, dataset in rows:
+            audio_id = self._audio_ids.setdefault(audio_path, len(self._audio_ids))
+            dataset_id = self._dataset_ids.setdefault(dataset, len(self._dataset_ids))
+            self._windows.append((audio_id, start, end, session, dataset_id))
+            for speeches in vad_list:
+                self._speeches.extend(speeches)
+                self._offsets.append(len(self._speeches))
+            if self._frames is not None:
+                self._frames.write(vad_list)
+
+    def _finish(self):
+        np.save(self._open(os.path.join(self.output_dir, "windows.npy"), "wb"), np.array(self._windows, dtype=self.WINDOW_DTYPE))
+        np.save(self._open(os.path.join(self.output_dir, "speeches.npy"), "wb"), np.array(self._speeches, dtype=np.float64).reshape(-1, 2))
+        np.save(self._open(os.path.join(self.output_dir, "offsets.npy"), "wb"), np.array(self._offsets, dtype=np.int64))
+        meta = {"audio_paths": list(self._audio_ids), "datasets": list(self._dataset_ids)}
+        if self._frames is not None:
+            meta.update(self._frames.meta())
+        json.dump(meta, self._open(os.path.join(self.output_dir, "meta.json"), "w", encoding="utf-8"))
+
+
+def load_npy(output_dir, mmap=True):
+    """
+    Read a directory written by NpyWriter.
+
+    Returns:
+        dict: windows, speeches, offsets, meta and, if they were written, frames (memory-mapped when mmap is True).
+    """
+    mmap_mode = "r" if mmap else None
+    with open(os.path.join(output_dir, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    data = {
+        "windows": np.load(os.path.join(output_dir, "windows.npy"), mmap_mode=mmap_mode),
+        "speeches": np.load(os.path.join(output_dir, "speeches.npy"), mmap_mode=mmap_mode),
+        "offsets": np.load(os.path.join(output_dir, "offsets.npy"), mmap_mode=mmap_mode),
+        "meta": meta,
+    }
+    if "frames_file" in meta:
+        shape = (len(data["windows"]), 2, meta["n_frames"])
+        frames_path = os.path.join(output_dir, meta["frames_file"])
+        data["frames"] = np.memmap(frames_path, dtype=np.uint8, mode="r", shape=shape) if mmap else np.fromfile(frames_path, dtype=np.uint8).reshape(shape)
+    return data
+
+
+class ParquetWriter(_AtomicWriter):
+    """
+    Segments as a Parquet file (needs pyarrow): vad_list is a nested list column instead of text.
+    The frame-level activity, when asked, is written next to it as <path>.frames.u8 with a <path>.frames.json
+    description (same layout as the frames.u8 of NpyWriter).
+    """
+
+    def __init__(self, path, frame_rate=None, frame_seconds=22, rows_per_group=10000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__()
+        self._pa = pa
+        self.path = path
+        self.rows_per_group = rows_per_group
+        self._schema = pa.schema([
+            ("audio_path", pa.dictionary(pa.int32(), pa.string())),
+            ("start", pa.float64()),
+            ("end", pa.float64()),
+            ("vad_list", pa.list_(pa.list_(pa.list_(pa.float64())))),
+            ("session", pa.int64()),
+            ("dataset", pa.string()),
+        ])
+        self._writer = self._stack.enter_context(pq.ParquetWriter(self._open(path, "wb"), self._schema))
+        self._rows = []
+        self._frames = None if frame_rate is None else _FrameFile(self, f"{path}.frames.u8", frame_rate, frame_seconds)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._rows.append(row)
+            if self._frames is not None:
+                self._frames.write(row[3])
+        if len(self._rows) >= self.rows_per_group:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        columns = [list(column) for column in zip(*self._rows)]
+        self._writer.write_table(self._pa.Table.from_arrays(
+            [self._pa.array(column, type=field.type) for column, field in zip(columns, self._schema)], schema=self._schema))
+        self._rows = []
+
+    def _finish(self):
+        self._flush()
+        if self._frames is not None:
+            json.dump(self._frames.meta(), self._open(f"{self.path}.frames.json", "w", encoding="utf-8"))
+
+
+def open_writer(output_format, path, frame_rate=None, frame_seconds=22):
+    """
+    Writer of the segments in one of FORMATS (frame_rate needs 'npy' or 'parquet'). Its files replace the
+    previous output when it is closed, or when its with block ends without error.
+    """
+    if output_format == "csv":
+        if frame_rate is not None:
+            raise ValueError("The csv format cannot store the frame-level activity, use npy or parquet")
+        return CsvWriter(path)
+    if output_format == "npy":
+        return NpyWriter(path, frame_rate, frame_seconds)
+    if output_format == "parquet":
+        return ParquetWriter(path, frame_rate, frame_seconds)
+    raise ValueError(f"Unknown output format {output_format!r}, expected one of {FORMATS}")